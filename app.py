@@ -3,29 +3,102 @@ import os
 import shutil
 import subprocess
 import zipfile
+import tarfile
+import hashlib
 from datetime import datetime
 import time
 import json
+import re
+import threading
+import signal
+import uuid
+import sys
 
 # ---------------- 路径配置 ----------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UTILS_DIR = os.path.join(BASE_DIR, "utils")
 CONF_DIR = os.path.join(BASE_DIR, "conf")
 os.makedirs(CONF_DIR, exist_ok=True)
+sys.path.insert(0, UTILS_DIR)
+import blob_store  # noqa: E402
 
-HEADERS_FILE = os.path.join(CONF_DIR, "headers.json")
-PROMPT_FILE = os.path.join(CONF_DIR, "prompt.txt")
 PROMPT_DEFAULT_FILE = os.path.join(CONF_DIR, "prompt_default.txt")
 
+# ---------------- 会话工作区 ----------------
+# 每个会话使用独立的工作区根目录（data_* 与 conf/ 均在其下），多人同时使用互不干扰
+WORKSPACES_DIR = os.path.join(BASE_DIR, "workspaces")
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))      # 全局同时执行的脚本数上限
+WORKSPACE_TTL_HOURS = float(os.environ.get("WORKSPACE_TTL_HOURS", 24))   # 超过该时长未活动的工作区自动清理
+# 允许“从服务器路径导入”的根目录（多个用 os.pathsep 分隔）；未配置时不提供该入口
+SERVER_IMPORT_ROOTS = [os.path.realpath(p) for p in os.environ.get("SERVER_IMPORT_ROOTS", "").split(os.pathsep) if p.strip()]
+WORKSPACE_CLEANUP_INTERVAL = 600  # 两次清理检查的最小间隔（秒）
+WORKSPACE_ID_PATTERN = re.compile(r"^\d{8}_\d{6}_[0-9a-f]{8}$")
+ACTIVE_MARKER = ".last_active"
+
+@st.cache_resource
+def job_slots():
+    """进程内所有会话共享的执行槽位"""
+    return threading.BoundedSemaphore(max(1, MAX_CONCURRENT_JOBS))
+
+@st.cache_resource
+def cleanup_state():
+    return {"last": 0.0}
+
+def touch_workspace(root):
+    """记录工作区最近活动时间，避免被自动清理"""
+    marker = os.path.join(root, ACTIVE_MARKER)
+    with open(marker, "a", encoding="utf-8"):
+        pass
+    os.utime(marker, None)
+
+def cleanup_workspaces(current_root):
+    """删除长时间未活动的工作区（当前会话除外）"""
+    state = cleanup_state()
+    if time.time() - state["last"] < WORKSPACE_CLEANUP_INTERVAL:
+        return
+    state["last"] = time.time()
+    cutoff = time.time() - WORKSPACE_TTL_HOURS * 3600
+    for name in os.listdir(WORKSPACES_DIR):
+        path = os.path.join(WORKSPACES_DIR, name)
+        if path == current_root or not os.path.isdir(path) or not WORKSPACE_ID_PATTERN.match(name):
+            continue
+        marker = os.path.join(path, ACTIVE_MARKER)
+        last_active = os.path.getmtime(marker if os.path.exists(marker) else path)
+        if last_active < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+def resolve_workspace():
+    """当前会话的工作区：优先沿用地址栏中的 ws 参数（刷新页面不丢数据），否则新建"""
+    ws_id = st.session_state.get("workspace_id")
+    if not ws_id:
+        ws_id = st.query_params.get("ws", "")
+        if not (WORKSPACE_ID_PATTERN.match(ws_id) and os.path.isdir(os.path.join(WORKSPACES_DIR, ws_id))):
+            ws_id = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+        st.session_state["workspace_id"] = ws_id
+    if st.query_params.get("ws") != ws_id:
+        st.query_params["ws"] = ws_id
+    root = os.path.join(WORKSPACES_DIR, ws_id)
+    os.makedirs(os.path.join(root, "conf"), exist_ok=True)
+    touch_workspace(root)
+    return root
+
+os.makedirs(WORKSPACES_DIR, exist_ok=True)
+WORKSPACE_ROOT = resolve_workspace()
+cleanup_workspaces(WORKSPACE_ROOT)
+
+HEADERS_FILE = os.path.join(WORKSPACE_ROOT, "conf", "headers.json")
+PROMPT_FILE = os.path.join(WORKSPACE_ROOT, "conf", "prompt.txt")
+
 DATA_DIRS = {
-    "ori": os.path.join(BASE_DIR, "data_00_ori"),
-    "csv": os.path.join(BASE_DIR, "data_01_csv"),
-    "pdf": os.path.join(BASE_DIR, "data_02_pdf"),
-    "json": os.path.join(BASE_DIR, "data_03_json"),
-    "txt": os.path.join(BASE_DIR, "data_04_summary_txt"),
-    "final": os.path.join(BASE_DIR, "data_05_final_pdf"),
-    "temp": os.path.join(BASE_DIR, "temp"),
+    "ori": os.path.join(WORKSPACE_ROOT, "data_00_ori"),
+    "csv": os.path.join(WORKSPACE_ROOT, "data_01_csv"),
+    "pdf": os.path.join(WORKSPACE_ROOT, "data_02_pdf"),
+    "json": os.path.join(WORKSPACE_ROOT, "data_03_json"),
+    "txt": os.path.join(WORKSPACE_ROOT, "data_04_summary_txt"),
+    "final": os.path.join(WORKSPACE_ROOT, "data_05_final_pdf"),
+    "temp": os.path.join(WORKSPACE_ROOT, "temp"),
 }
+BLOB_STORE = blob_store.store_dir(WORKSPACE_ROOT)  # 各阶段目录中的原始文件均为此处内容的硬链接
 
 # SCRIPTS = [
 #     ("01_parse_xls_to_csv.py", "Excel 转 CSV"),
@@ -41,10 +114,33 @@ SCRIPTS = [
     ("00_read_headers.py", "字段解析与映射"),
     ("02_rename_pdf.py", "源文档重命名"),
     ("03_merge_csv_to_json.py", "多源数据融合"),
+    ("03b_compact_lab_results.py", "检验结果压缩"),
     ("04_generate_reports_infini.py", "AI智能报告生成"),
     ("05_merge_txt_to_pdf.py", "成果文档整合"),
 ]
 
+# 流水线模式：字段选择后，按病案流式执行 02 → 03 → 03b → 04 → 05
+PIPELINE_SCRIPTS = [
+    ("01_parse_xls_to_csv.py", "数据格式标准化"),
+    ("00_read_headers.py", "字段解析与映射"),
+    ("pipeline.py", "融合 · 报告 · 整合（流水线）"),
+]
+
+# 执行前需要暂停编辑 Prompt 的步骤
+PROMPT_SCRIPTS = {"04_generate_reports_infini.py", "pipeline.py"}
+
+# 支持 --cases 病案号子集参数的步骤
+CASE_FILTER_SCRIPTS = {
+    "02_rename_pdf.py",
+    "03_merge_csv_to_json.py",
+    "03b_compact_lab_results.py",
+    "04_generate_reports_infini.py",
+    "05_merge_txt_to_pdf.py",
+    "pipeline.py",
+}
+CASE_IDS_FILE = os.path.join(DATA_DIRS["temp"], "case_ids.txt")
+REPORT_PLAN_FILE = os.path.join(DATA_DIRS["temp"], "report_plan.json")
+
 
 headers_default_file = os.path.join(CONF_DIR, "headers_default.json")
 if os.path.exists(headers_default_file):
@@ -58,24 +154,197 @@ else:
     headers_default = {}
 
 # ---------------- 工具函数 ----------------
-def clean_folders():
-    for key in ["ori", "csv", "pdf", "json", "txt", "final"]:
+def discard_report_plan():
+    """输入数据变化后，此前的试运行结果已不对应当前批次"""
+    if os.path.exists(REPORT_PLAN_FILE):
+        os.remove(REPORT_PLAN_FILE)
+
+def load_report_plan(prompt_text):
+    """读取试运行结果；仅当其 Prompt 与生成参数与当前设置一致时返回，否则返回 None"""
+    if not os.path.exists(REPORT_PLAN_FILE):
+        return None
+    try:
+        with open(REPORT_PLAN_FILE, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except Exception:
+        return None
+    current = {
+        "mode": st.session_state.get("report_mode", "serial"),
+        "workers": st.session_state.get("report_workers", 1),
+        "pack_budget": st.session_state.get("report_pack_budget", 0),
+        "rpm": st.session_state.get("report_rpm", 0),
+        "tpm": st.session_state.get("report_tpm", 0),
+        "prompt_sha256": hashlib.sha256((prompt_text or "").encode("utf-8")).hexdigest(),
+    }
+    if any(plan.get(k) != v for k, v in current.items()):
+        return None
+    return plan
+
+def release_folders(keys):
+    """清空指定目录（只删除链接，即减少引用），再回收已无任何引用的库内容"""
+    for key in keys:
         path = DATA_DIRS[key]
         if os.path.exists(path):
             shutil.rmtree(path)
         os.makedirs(path, exist_ok=True)
     os.makedirs(DATA_DIRS["temp"], exist_ok=True)
+    discard_report_plan()
+    return blob_store.gc(BLOB_STORE)
+
+def clean_folders():
+    return release_folders(["ori", "csv", "pdf", "json", "txt", "final"])
+
+# ---------------- 上传入库（流式写入 / 压缩包解压 / 内容去重） ----------------
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 流式写入块大小
+UPLOAD_INDEX_FILE = os.path.join(DATA_DIRS["ori"], blob_store.UPLOAD_INDEX_NAME)  # 内容哈希 -> 文件名
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def reset_outputs():
+    """清空各步骤的输出目录，保留已上传的原始文件（其内容仍被 data_00_ori 引用，不会被回收）"""
+    release_folders(["csv", "pdf", "json", "txt", "final"])
+
+def load_upload_index():
+    """读取已入库文件的哈希索引，忽略已不存在的文件"""
+    if not os.path.exists(UPLOAD_INDEX_FILE):
+        return {}
+    try:
+        with open(UPLOAD_INDEX_FILE, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except Exception:
+        return {}
+    return {h: name for h, name in index.items() if os.path.exists(os.path.join(DATA_DIRS["ori"], name))}
+
+def save_upload_index(index):
+    with open(UPLOAD_INDEX_FILE, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+def target_name(name, index):
+    """
+    确定入库文件名：PDF 以内容区分病案，同名不同内容时追加序号（如不同目录下同名 PDF）；
+    其他文件（数据表）视为新版本，覆盖同名旧文件。
+    """
+    if not name.lower().endswith(".pdf"):
+        for h, existing in list(index.items()):
+            if existing == name:
+                del index[h]
+        return name
+    names = set(index.values())
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in names or os.path.exists(os.path.join(DATA_DIRS["ori"], candidate)):
+        candidate = f"{base}_{n}{ext}"
+        n += 1
+    return candidate
+
+def ingest_stream(src, name, index):
+    """
+    将文件流分块写入临时文件，同时计算 sha256。
+    内容已存在时跳过并返回 None，否则移入文件库、在 data_00_ori 中建立硬链接并返回最终文件名。
+    """
+    name = os.path.basename(name.replace("\\", "/"))
+    tmp_path = os.path.join(DATA_DIRS["ori"], f".{name}.part")
+    try:
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = src.read(UPLOAD_CHUNK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+        h = digest.hexdigest()
+        if h in index:
+            return None
+        final_name = target_name(name, index)
+        blob = blob_store.put(BLOB_STORE, tmp_path, digest=h, move=True)
+        blob_store.link(blob, os.path.join(DATA_DIRS["ori"], final_name))
+        index[h] = final_name
+        return final_name
+    finally:
+        # 重复内容、读取中断（压缩包损坏、连接断开）时都不留下半截临时文件
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def zip_member_name(info):
+    """未设置 UTF-8 标志的 zip（常见于 Windows 打包）按 GBK 还原中文文件名"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+def skip_member(name):
+    parts = name.replace("\\", "/").split("/")
+    return "__MACOSX" in parts or os.path.basename(name).startswith(".")
+
+def ingest_archive(fileobj, archive_name, index, stats):
+    """逐个成员流式解压入库，不在内存中展开整个压缩包"""
+    if archive_name.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                name = zip_member_name(info)
+                if info.is_dir() or skip_member(name):
+                    continue
+                with zf.open(info) as src:
+                    stats["saved" if ingest_stream(src, name, index) else "skipped"] += 1
+    else:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+            for member in tf:
+                if not member.isfile() or skip_member(member.name):
+                    continue
+                src = tf.extractfile(member)
+                stats["saved" if ingest_stream(src, member.name, index) else "skipped"] += 1
+
+def ingest_file(fileobj, name, index, stats):
+    if name.lower().endswith(ARCHIVE_SUFFIXES):
+        ingest_archive(fileobj, name, index, stats)
+    else:
+        stats["saved" if ingest_stream(fileobj, name, index) else "skipped"] += 1
 
 def save_uploaded_files(uploaded_files):
-    clean_folders()
-    saved = []
+    """保存浏览器上传的文件（支持 ZIP/TAR 压缩包），内容重复的文件跳过"""
+    reset_outputs()
+    os.makedirs(DATA_DIRS["ori"], exist_ok=True)
+    index = load_upload_index()
+    stats = {"saved": 0, "skipped": 0}
+    try:
+        for file in uploaded_files:
+            file.seek(0)
+            ingest_file(file, file.name, index, stats)
+    finally:
+        # 中途失败时已入库的文件也要记入索引，否则重新上传会被当作同名新文件
+        save_upload_index(index)
+    return stats
+
+def resolve_import_path(path):
+    """解析服务器路径（含符号链接）并确认其位于允许导入的根目录内，否则抛出 ValueError"""
+    real = os.path.realpath(path)
+    for root in SERVER_IMPORT_ROOTS:
+        if os.path.commonpath([real, root]) == root:
+            return real
+    raise ValueError(f"路径不在允许导入的目录内：{path}")
+
+def ingest_server_path(path):
+    """直接从服务器本地路径（文件、压缩包或目录）入库，适合超大批次，避免经由浏览器上传"""
+    path = resolve_import_path(path)
+    if os.path.isdir(path):
+        targets = [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+    else:
+        targets = [path]
+    # 目录内的符号链接同样不得指向允许范围之外；先全部校验，再清空旧结果开始入库
+    targets = [(os.path.basename(t), resolve_import_path(t)) for t in targets if not skip_member(t)]
+    reset_outputs()
     os.makedirs(DATA_DIRS["ori"], exist_ok=True)
-    for file in uploaded_files:
-        dest = os.path.join(DATA_DIRS["ori"], file.name)
-        with open(dest, "wb") as f:
-            f.write(file.getbuffer())
-        saved.append(dest)
-    return saved
+    index = load_upload_index()
+    stats = {"saved": 0, "skipped": 0}
+    try:
+        for name, target in targets:
+            with open(target, "rb") as f:
+                ingest_file(f, name, index, stats)
+    finally:
+        save_upload_index(index)
+    return stats
 
 def make_zip():
     os.makedirs(DATA_DIRS["temp"], exist_ok=True)
@@ -87,11 +356,110 @@ def make_zip():
     with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
         for f in os.listdir(folder):
             fpath = os.path.join(folder, f)
-            zipf.write(fpath, arcname=f)
+            # PDF 本身已压缩，直接存储，避免对整批 PDF 再做一遍无效的 deflate
+            compress = zipfile.ZIP_STORED if f.lower().endswith(".pdf") else zipfile.ZIP_DEFLATED
+            zipf.write(fpath, arcname=f, compress_type=compress)
     return zip_path
 
-def run_script(script_name, log_area, timeout=None):
-    logs = []
+def save_case_ids(text):
+    """保存本次运行要处理的病案号清单；为空则删除清单（处理全部病案）"""
+    case_ids = [t for t in re.split(r"[\s,，;；]+", text or "") if t.strip()]
+    if not case_ids:
+        if os.path.exists(CASE_IDS_FILE):
+            os.remove(CASE_IDS_FILE)
+        return 0
+    os.makedirs(DATA_DIRS["temp"], exist_ok=True)
+    with open(CASE_IDS_FILE, "w", encoding="utf-8") as f:
+        f.write("\n".join(case_ids))
+    return len(case_ids)
+
+def script_args(script_name):
+    """根据当前设置拼接传给步骤脚本的参数"""
+    args = ["--workspace", WORKSPACE_ROOT]
+    if script_name in CASE_FILTER_SCRIPTS and os.path.exists(CASE_IDS_FILE):
+        args += ["--cases", CASE_IDS_FILE]
+    if script_name == "01_parse_xls_to_csv.py" and os.path.exists(CASE_IDS_FILE):
+        args += ["--row-index"]  # 只处理部分病案时，03 按行索引读取命中的行
+    if script_name == "03b_compact_lab_results.py" and st.session_state.get("lab_abnormal_only"):
+        args += ["--abnormal-only"]
+    if script_name == "04_generate_reports_infini.py":
+        args += [
+            "--mode", st.session_state.get("report_mode", "serial"),
+            "--workers", str(st.session_state.get("report_workers", 1)),
+            "--pack-budget", str(st.session_state.get("report_pack_budget", 0)),
+            "--rpm", str(st.session_state.get("report_rpm", 0)),
+            "--tpm", str(st.session_state.get("report_tpm", 0)),
+        ]
+    if script_name == "pipeline.py":
+        args += [
+            "--mode", st.session_state.get("report_mode", "serial"),
+            "--workers", str(st.session_state.get("report_workers", 1)),
+            "--compact",
+        ]
+        if st.session_state.get("lab_abnormal_only"):
+            args += ["--abnormal-only"]
+    return args
+
+def kill_job_group(process, sig):
+    """向任务所在进程组发送信号；进程可能恰好已退出，此时忽略"""
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+def stop_job(job):
+    """终止任务（含其启动的各阶段子进程），等待其退出；槽位由日志线程在进程退出后归还"""
+    process = job["process"]
+    if process.poll() is None:
+        kill_job_group(process, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            kill_job_group(process, signal.SIGKILL)
+            process.wait()
+    job["thread"].join()
+
+def cancel_job():
+    """用户主动终止本会话的任务"""
+    job = st.session_state.pop("job", None)
+    if job is not None:
+        stop_job(job)
+
+def start_job(cmd, slots):
+    """
+    启动任务并由后台线程读取其输出。任务记在 session_state 中，
+    页面重跑（用户操作触发 RerunException）不会中断任务，重跑后 run_script 重新接上同一任务；
+    槽位在进程真正退出后才归还。
+    """
+    try:
+        process = subprocess.Popen(
+            cmd,
+            cwd=BASE_DIR,
+            text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            start_new_session=True,  # 独立进程组，终止时连同其启动的各阶段子进程一并结束
+        )
+    except Exception:
+        slots.release()
+        raise
+    job = {"cmd": cmd, "process": process, "logs": [], "start_time": time.time()}
+
+    def pump():
+        try:
+            for line in process.stdout:
+                job["logs"].append(line.rstrip())
+            process.wait()
+        finally:
+            slots.release()
+
+    job["thread"] = threading.Thread(target=pump, daemon=True)
+    job["thread"].start()
+    st.session_state["job"] = job
+    return job
+
+def run_script(script_name, log_area, timeout=None, extra_args=None):
     script_path = os.path.join(UTILS_DIR, script_name)
     if not os.path.exists(script_path):
         # 若日志可见则写入，否则直接 info
@@ -101,19 +469,35 @@ def run_script(script_name, log_area, timeout=None):
             log_area.info(f"⚠️ 脚本不存在：{script_name}")
         return False
 
-    process = subprocess.Popen(
-        ["python3", script_path],
-        cwd=BASE_DIR,
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-    )
-
-    start_time = time.time()
-    for line in process.stdout:
-        logs.append(line.rstrip())
-        if st.session_state.get("show_logs", True):
+    cmd = ["python3", script_path] + script_args(script_name) + (extra_args or [])
+    job = st.session_state.get("job")
+    if job is not None and job["cmd"] != cmd:
+        if job["thread"].is_alive():
+            log_area.info(f"⚠️ 当前会话仍有任务在执行：{os.path.basename(job['cmd'][1])}，请等待其结束或点击“终止当前任务”。")
+            return False
+        # 上一个任务已结束但结果未被读取（如中途清空），丢弃
+        st.session_state.pop("job")
+        job = None
+
+    if job is None:
+        # 除试运行本身外，任何步骤都可能改变待生成的病案，旧的试运行结果作废
+        if "--dry-run" not in (extra_args or []):
+            discard_report_plan()
+
+        # 全局并发上限：槽位已满时排队等待
+        slots = job_slots()
+        if not slots.acquire(blocking=False):
+            log_area.info(f"⏳ 当前已有 {MAX_CONCURRENT_JOBS} 个任务在执行，正在排队等待...")
+            slots.acquire()
+        job = start_job(cmd, slots)
+
+    last_touch = time.time()
+    shown = -1
+    while True:
+        alive = job["thread"].is_alive()
+        logs = job["logs"]
+        if st.session_state.get("show_logs", True) and len(logs) != shown:
+            shown = len(logs)
             log_html = (
                 "<div style='background:#111;color:#0f0;padding:10px;height:360px;overflow-y:auto;"
                 "font-family:monospace;font-size:14px;border-radius:6px;'>"
@@ -121,27 +505,32 @@ def run_script(script_name, log_area, timeout=None):
                 + "</div>"
             )
             log_area.markdown(log_html, unsafe_allow_html=True)
-        # tiny sleep to allow front-end update
-        time.sleep(0.02)
-        if timeout and (time.time() - start_time) > timeout:
-            process.kill()
-            logs.append("❌ 脚本执行超时并被终止。")
+        if not alive:
             break
+        # 长时间运行的任务定期刷新活动时间，防止工作区被清理
+        if time.time() - last_touch > 60:
+            touch_workspace(WORKSPACE_ROOT)
+            last_touch = time.time()
+        if timeout and (time.time() - job["start_time"]) > timeout:
+            logs.append("❌ 脚本执行超时并被终止。")
+            stop_job(job)
+        # tiny sleep to allow front-end update
+        time.sleep(0.2)
 
-    process.wait()
-    success = process.returncode == 0
-    return success
+    st.session_state.pop("job", None)
+    return job["process"].returncode == 0
 
 # ---------------- Streamlit 页面布局 ----------------
 st.set_page_config(page_title="数据处理一键工具", page_icon="📊", layout="centered")
 st.markdown(
     """
     <h1 style='text-align:center;'>📊 数据处理一键工具</h1>
-    <p style='text-align:center;color:gray;'>上传（清空旧数据）→ 执行脚本（暂停编辑字段 / Prompt）→ 下载</p>
+    <p style='text-align:center;color:gray;'>上传（相同内容自动去重）→ 执行脚本（暂停编辑字段 / Prompt）→ 下载</p>
     <hr/>
     """,
     unsafe_allow_html=True,
 )
+st.caption(f"🗂️ 当前工作区：{st.session_state['workspace_id']}（收藏当前网址可在刷新后继续使用）")
 
 # === 上传区 ===
 st.subheader("📁 上传原始文件")
@@ -157,10 +546,33 @@ _defaults = {
     "prompt_running": False,   # 点击确认后变 True，表示正在处理 Prompt 步骤
     "show_logs": True,
     "prompt_input": None,      # 存放 text_area 的内容
+    "report_mode": "serial",   # 报告生成模式：serial / mapreduce
+    "report_workers": 1,       # 同时生成报告的病案数
+    "report_pack_budget": 0,   # 小病案打包请求的输入 token 预算，0 表示不打包
+    "report_rpm": int(os.environ.get("RPM_LIMIT", 0)),  # 试运行估算用的每分钟请求数上限，0 表示不限
+    "report_tpm": int(os.environ.get("TPM_LIMIT", 0)),  # 试运行估算用的每分钟 token 数上限，0 表示不限
+    "lab_abnormal_only": False,  # 检验结果压缩时仅保留异常值及首末、极值点
+    "pipeline_mode": False,    # 流水线模式：病案逐个流经各步骤，不等待整批完成
 }
 for k, v in _defaults.items():
     st.session_state.setdefault(k, v)
 
+ACTIVE_SCRIPTS = PIPELINE_SCRIPTS if st.session_state["pipeline_mode"] else SCRIPTS
+
+def on_ingested(stats):
+    st.session_state.update({
+        "uploaded": True,
+        "uploaded_count": st.session_state.get("uploaded_count", 0) + stats["saved"],
+        "step": 0,
+        "header_edit_done": False,
+        "prompt_edit_done": False,
+        "prompt_running": False,
+        "prompt_input": None,
+    })
+    st.success(f"✅ 新增 {stats['saved']} 个文件，跳过 {stats['skipped']} 个重复文件，旧的处理结果已清空。")
+    time.sleep(1)
+    st.rerun()
+
 # 上传逻辑
 if uploaded_files:
     file_names = [f.name for f in uploaded_files]
@@ -172,27 +584,47 @@ if uploaded_files:
     )
     if st.button("⬆️ 上传并保存文件", type="primary"):
         try:
-            saved = save_uploaded_files(uploaded_files)
-            st.session_state.update({
-                "uploaded": True,
-                "uploaded_count": len(saved),
-                "step": 0,
-                "header_edit_done": False,
-                "prompt_edit_done": False,
-                "prompt_running": False,
-                "prompt_input": None,
-            })
-            st.success(f"✅ 已上传 {len(saved)} 个文件，旧数据已清空。")
-            time.sleep(1)
-            st.rerun()
+            on_ingested(save_uploaded_files(uploaded_files))
         except Exception as e:
             st.error(f"❌ 上传保存失败：{e}")
 else:
-    st.info("提示：选择文件后点击“上传并保存文件”开始。")
+    st.info("提示：选择文件（可直接选择 ZIP/TAR 压缩包）后点击“上传并保存文件”开始。")
+
+# 仅在配置了 SERVER_IMPORT_ROOTS 时提供，且只能导入这些目录内的文件
+if SERVER_IMPORT_ROOTS:
+    with st.expander("🗄️ 从服务器路径导入（大批量数据）"):
+        st.caption("允许导入的目录：" + "，".join(SERVER_IMPORT_ROOTS))
+        server_path = st.text_input("服务器上的文件、压缩包或目录路径", key="server_path")
+        if st.button("📥 导入", disabled=not server_path):
+            if not os.path.exists(server_path):
+                st.error(f"❌ 路径不存在：{server_path}")
+            else:
+                try:
+                    on_ingested(ingest_server_path(server_path))
+                except Exception as e:
+                    st.error(f"❌ 导入失败：{e}")
 
 if st.session_state["uploaded"]:
     st.success(f"✅ 已成功上传 {st.session_state.get('uploaded_count', 0)} 个文件。")
 
+st.markdown("---")
+st.subheader("🎯 病案号筛选（可选）")
+case_ids_text = st.text_area(
+    "仅处理以下病案号（逗号、空格或换行分隔，留空则处理全部）",
+    height=100,
+    key="case_ids_input",
+)
+case_ids_upload = st.file_uploader("或上传病案号清单（txt/csv，每行一个）", type=["txt", "csv"], key="case_ids_upload")
+st.checkbox(
+    "🧪 检验结果仅保留异常值及首次、末次、极值（进一步减少报告生成的 token 数）",
+    key="lab_abnormal_only",
+)
+st.checkbox(
+    "⚡ 流水线模式：每个病案的数据就绪后立即生成报告并合并 PDF，首批结果更快出现",
+    key="pipeline_mode",
+    disabled=st.session_state["running"],
+)
+
 st.markdown("---")
 st.subheader("🧭 执行进度与日志")
 
@@ -217,7 +649,7 @@ else:
 # 步骤卡片显示
 cols = st.columns(3)
 steps_placeholders = []
-for i, (_, cname) in enumerate(SCRIPTS):
+for i, (_, cname) in enumerate(ACTIVE_SCRIPTS):
     with cols[i % 3]:
         ph = st.empty()
         ph.markdown(f"⚪ **{cname}** — 未开始")
@@ -233,8 +665,20 @@ with col1:
         st.warning("⚠️ 请先上传并保存文件。")
     elif st.session_state["running"]:
         st.button("⏳ 执行中...", disabled=True, use_container_width=True)
+        if st.button("⏹️ 终止当前任务", use_container_width=True):
+            cancel_job()
+            st.session_state["running"] = False
+            st.session_state["prompt_running"] = False
+            st.rerun()
     else:
         if st.button("🚀 开始执行全部步骤", type="primary", use_container_width=True):
+            cancel_job()  # 清除上一轮中断后遗留的任务
+            case_ids_all = case_ids_text or ""
+            if case_ids_upload is not None:
+                case_ids_all += "\n" + case_ids_upload.getvalue().decode("utf-8-sig", errors="ignore")
+            n_cases = save_case_ids(case_ids_all)
+            if n_cases:
+                st.info(f"🎯 本次仅处理 {n_cases} 个指定病案号。")
             st.session_state.update({
                 "running": True,
                 "step": 0,
@@ -246,20 +690,21 @@ with col1:
 
 with col2:
     if st.button("🧹 清空过程文件（手动）", use_container_width=True):
-        clean_folders()
+        cancel_job()
+        removed, freed = clean_folders()
         for key in ["uploaded", "running", "header_edit_done", "prompt_edit_done", "prompt_running"]:
             st.session_state[key] = False
         st.session_state["step"] = 0
         st.session_state["prompt_input"] = None
-        st.success("✅ 已清理所有数据目录。")
+        st.success(f"✅ 已清理当前工作区的数据目录，回收 {removed} 个文件（{freed / 1024 / 1024:.1f} MB）。")
         st.rerun()
 
 # ---------------- 执行逻辑 ----------------
 if st.session_state["running"]:
-    total = len(SCRIPTS)
+    total = len(ACTIVE_SCRIPTS)
 
     # 更新每一步的可视状态
-    for idx, (_, cname) in enumerate(SCRIPTS):
+    for idx, (_, cname) in enumerate(ACTIVE_SCRIPTS):
         if idx < st.session_state["step"]:
             steps_placeholders[idx].markdown(f"🟢 **{cname}** — 已完成")
         elif idx == st.session_state["step"]:
@@ -268,7 +713,7 @@ if st.session_state["running"]:
             steps_placeholders[idx].markdown(f"⚪ **{cname}** — 未开始")
 
     if st.session_state["step"] < total:
-        script_name, cname = SCRIPTS[st.session_state["step"]]
+        script_name, cname = ACTIVE_SCRIPTS[st.session_state["step"]]
 
         # 暂停点：字段选择（与之前相同）
         if script_name == "00_read_headers.py" and not st.session_state["header_edit_done"]:
@@ -307,7 +752,7 @@ if st.session_state["running"]:
                     st.session_state["running"] = False
 
         # 暂停点：Prompt 编辑（关键修复点）
-        elif script_name == "04_generate_reports_infini.py" and not st.session_state["prompt_edit_done"]:
+        elif script_name in PROMPT_SCRIPTS and not st.session_state["prompt_edit_done"]:
             st.markdown("### 💬 报告生成 Prompt 设置")
             st.info("请在下方输入或修改 prompt 内容")
 
@@ -328,6 +773,22 @@ if st.session_state["running"]:
             # --- 3) 渲染 text_area（只指定 key，不传 value，避免双重赋值警告） ---
             prompt_text = st.text_area("Prompt 内容：", height=240, key="prompt_input")
 
+            col_mode, col_workers = st.columns([2, 1])
+            col_mode.selectbox(
+                "生成模式",
+                options=["serial", "mapreduce"],
+                format_func=lambda m: {"serial": "逐段串行续写", "mapreduce": "分区并发 + 汇总（长住院病案更快）"}[m],
+                key="report_mode",
+            )
+            col_workers.number_input("并发病案数", min_value=1, max_value=32, step=1, key="report_workers")
+            # 流水线模式下病案逐个到达，不支持打包与试运行
+            is_pipeline = script_name == "pipeline.py"
+            if not is_pipeline:
+                st.number_input(
+                    "小病案打包 token 预算（0 表示不打包，建议 20000–40000）",
+                    min_value=0, max_value=100000, step=5000, key="report_pack_budget",
+                )
+
             # --- 4) 按钮显示与禁用逻辑 ---
             # 按钮 label 动态：若正在处理则显示“⏳ 执行中...”
             if st.session_state.get("prompt_running", False):
@@ -337,6 +798,31 @@ if st.session_state["running"]:
                 btn_label = "✅ 确认使用该 Prompt 并继续执行"
                 btn_disabled = False
 
+            # --- 试运行：执行前预估请求量、token 与耗时 ---
+            if not is_pipeline:
+                col_rpm, col_tpm = st.columns(2)
+                col_rpm.number_input("接口每分钟请求数上限（RPM，0 表示不限）", min_value=0, step=60, key="report_rpm")
+                col_tpm.number_input("接口每分钟 token 上限（TPM，0 表示不限）", min_value=0, step=10000, key="report_tpm")
+            if not is_pipeline and st.button("📊 预估请求量与耗时（不调用接口）", disabled=btn_disabled, key="plan_prompt"):
+                with open(PROMPT_FILE, "w", encoding="utf-8") as f:
+                    f.write(st.session_state.get("prompt_input", "") or "")
+                if not run_script(script_name, log_area, extra_args=["--dry-run"]):
+                    st.error("❌ 试运行失败，请检查日志。")
+            plan = None if is_pipeline else load_report_plan(prompt_text)
+            if plan:
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("病案数", plan["cases"])
+                m2.metric("请求数", plan["requests"])
+                m3.metric("输入 token", f"{plan['input_tokens']:,}")
+                m4.metric("预估耗时", f"{plan['estimated_seconds'] / 3600:.2f} 小时")
+                st.caption(
+                    f"模式 {plan['mode']}，并发 {plan['workers']}；token 计数方式：{plan['tokenizer']}"
+                    + ("；耗时受速率限制" if plan["rate_limited"] else "")
+                )
+                if plan["largest_cases"]:
+                    st.markdown("**输入量最大的病案**")
+                    st.dataframe(plan["largest_cases"], use_container_width=True)
+
             clicked = st.button(btn_label, disabled=btn_disabled, key="confirm_prompt")
 
             # 点击后：**立即保存 prompt 到文件，设置 prompt_running=True，然后 rerun**
@@ -401,7 +887,7 @@ if st.session_state["running"]:
         progress_bar.progress(1.0)
 
 # ---------------- 打包下载 ----------------
-if not st.session_state["running"] and st.session_state["step"] >= len(SCRIPTS):
+if not st.session_state["running"] and st.session_state["step"] >= len(ACTIVE_SCRIPTS):
     st.markdown("---")
     st.subheader("📦 打包并下载结果 ZIP")
     if st.button("📁 生成 ZIP 压缩包", type="primary", use_container_width=True):
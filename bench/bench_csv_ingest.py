@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, "utils"))
+
+from csv_reader import read_csv_pandas, read_tables  # noqa: E402
+
+# ========== 合成数据的列定义（与 conf/headers.json 中的字段一致） ==========
+TABLE_COLUMNS = {
+    "检查信息": ["病案号", "医嘱名称", "检查结果", "报告时间"],
+    "检验信息": ["病案号", "检验项目", "检验项目名称", "检验结果", "检验标志", "阴阳性", "单位", "标本", "采集时间", "报告日期"],
+    "病案首页": ["病案号", "住院次数", "入院日期", "出院日期", "性别", "年龄", "出院科室", "出院诊断", "住院总费用"],
+    "医嘱信息": ["病案号", "医嘱类型", "医嘱分类", "医嘱名称", "医嘱开始时间", "医嘱结束时间", "费用分类名称", "药品规格", "药品剂型名称"],
+}
+# 各表在总数据量中的占比（检验、医嘱通常最大）
+TABLE_SHARE = {"检查信息": 0.1, "检验信息": 0.45, "病案首页": 0.05, "医嘱信息": 0.4}
+VALUES = ["血常规", "肝功能", "阴性", "↑", "↓", "mmol/L", "静脉血", "利培酮片 1mg", "长期医嘱", "护理费", "12.5", "98"]
+
+
+def generate_table(path, columns, target_bytes, n_cases, encoding):
+    """生成约 target_bytes 大小的合成 CSV"""
+    rng = random.Random(path)
+    with open(path, "w", encoding=encoding, newline="") as f:
+        f.write(",".join(columns) + "\n")
+        written = 0
+        while written < target_bytes:
+            row = [str(rng.randint(1, n_cases))] + [
+                f"2024-0{rng.randint(1, 9)}-{rng.randint(10, 28)} 08:00:00" if "时间" in c or "日期" in c
+                else rng.choice(VALUES)
+                for c in columns[1:]
+            ]
+            line = ",".join(row) + "\n"
+            f.write(line)
+            written += len(line.encode(encoding))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 03 阶段四张表的读取耗时：pandas 串行 vs pyarrow 并发")
+    parser.add_argument("--size-mb", type=int, default=2048, help="四张表合计的大小（MB）")
+    parser.add_argument("--cases", type=int, default=50000, help="合成数据中的病案数")
+    parser.add_argument("--data-dir", default=None, help="数据目录，已有同名 CSV 时直接复用")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件（用于评估是否把默认引擎改为 auto）")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench_csv_")
+    os.makedirs(data_dir, exist_ok=True)
+    tables = {name: os.path.join(data_dir, f"{name}.csv") for name in TABLE_COLUMNS}
+    for name, path in tables.items():
+        if not os.path.exists(path):
+            # 检验信息用 GBK 编码，覆盖编码回退路径
+            encoding = "gbk" if name == "检验信息" else "utf-8-sig"
+            print(f"🛠️ 生成 {name}.csv ...")
+            generate_table(path, TABLE_COLUMNS[name], int(args.size_mb * TABLE_SHARE[name] * 1024 * 1024),
+                           args.cases, encoding)
+
+    total_mb = sum(os.path.getsize(p) for p in tables.values()) / 1024 / 1024
+    print(f"📁 数据目录：{data_dir}（合计 {total_mb:.0f} MB，CPU 核数：{os.cpu_count()}）")
+
+    start = time.time()
+    for path in tables.values():
+        read_csv_pandas(path)
+    pandas_seconds = time.time() - start
+    print(f"🐼 pandas 串行读取：{pandas_seconds:.1f} 秒")
+
+    start = time.time()
+    read_tables(tables, engine="pyarrow")
+    arrow_seconds = time.time() - start
+    print(f"🏹 pyarrow 并发读取：{arrow_seconds:.1f} 秒")
+
+    print(f"🚀 加速比：{pandas_seconds / arrow_seconds:.1f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"size_mb": round(total_mb), "cpu_count": os.cpu_count(), "pandas_seconds": round(pandas_seconds, 1),
+                       "pyarrow_seconds": round(arrow_seconds, 1), "speedup": round(pandas_seconds / arrow_seconds, 2)},
+                      f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
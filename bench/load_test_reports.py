@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGE_04 = os.path.join(BASE_DIR, "utils", "04_generate_reports_infini.py")
+STUB_SERVER = os.path.join(BASE_DIR, "bench", "stub_llm_server.py")
+PROMPT_FILE = os.path.join(BASE_DIR, "conf", "prompt_default.txt")
+
+# ========== 04 阶段压测：本地 stub 服务 + 多档并发 ==========
+STUB_OPTIONS = ["latency", "latency_mean", "latency_sigma", "error_429", "error_5xx", "tpm", "output_chars", "seed"]
+
+
+def make_workspace(root, n_cases, case_chars, seed):
+    """生成合成病案 JSON 与占位 PDF；约 1/5 的病案为长住院（多分块）病案"""
+    rng = random.Random(seed)
+    for d in ("data_03_json", "data_02_pdf", "conf"):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    shutil.copy(PROMPT_FILE, os.path.join(root, "conf", "prompt.txt"))
+    for i in range(1, n_cases + 1):
+        case_id = f"{i:06d}"
+        size = case_chars * (rng.choice([4, 6, 8]) if i % 5 == 0 else 1)
+        labs = []
+        while len(json.dumps(labs, ensure_ascii=False)) < size:
+            labs.append({
+                "检验项目名称": rng.choice(["白细胞计数", "血红蛋白测定", "泌乳素", "谷丙转氨酶"]),
+                "检验结果": round(rng.uniform(1, 200), 1),
+                "单位": "U/L",
+                "采集时间": f"2024-0{rng.randint(1, 9)}-{rng.randint(10, 28)} 08:00:00",
+            })
+        record = {"病案首页": {"病案号": case_id, "性别": "女", "年龄": rng.randint(18, 90)},
+                  "检查信息": [], "检验信息": labs, "医嘱信息": []}
+        with open(os.path.join(root, "data_03_json", f"{case_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(root, "data_02_pdf", f"{case_id}.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4\n")
+
+
+def http(url, method="GET"):
+    request = urllib.request.Request(url, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_level(workspace, base_url, workers, mode, pack_budget=0):
+    """以指定并发运行一次 04 阶段，返回结果统计"""
+    shutil.rmtree(os.path.join(workspace, "data_04_summary_txt"), ignore_errors=True)
+    metrics_file = os.path.join(workspace, "temp", "llm_requests.jsonl")
+    if os.path.exists(metrics_file):
+        os.remove(metrics_file)
+    http(base_url.replace("/v1", "/reset"), "POST")
+    env = dict(os.environ, LLM_BASE_URL=base_url, LLM_API_KEY="stub")
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, STAGE_04, "--workspace", workspace, "--workers", str(workers), "--mode", mode,
+         "--pack-budget", str(pack_budget)],
+        env=env, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    elapsed = time.time() - start
+    stats = http(base_url.replace("/v1", "/stats"))
+    txt_dir = os.path.join(workspace, "data_04_summary_txt")
+    # 只统计完成的报告，不含生成中的 .txt.part 与续跑检查点
+    reports = sum(1 for f in os.listdir(txt_dir) if f.endswith(".txt")) if os.path.isdir(txt_dir) else 0
+    latencies = stats["latencies"]
+    # 04 阶段按请求记录的首字延迟与输出速度（流式模式下才有意义）
+    requests = []
+    if os.path.exists(metrics_file):
+        with open(metrics_file, "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+    ttfts = [r["ttft_s"] for r in requests]
+    tps = [r["tokens_per_s"] for r in requests if r["tokens_per_s"]]
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 1),
+        "reports": reports,
+        "cases_per_min": round(reports / elapsed * 60, 1) if elapsed else 0,
+        "requests": stats["requests"],
+        "requests_per_s": round(stats["requests"] / elapsed, 2) if elapsed else 0,
+        # stub 注入的错误响应数；客户端是否重试取决于 LLM_MAX_RETRIES，不能等同于重试次数
+        "server_errors": stats["status_429"] + stats["status_5xx"],
+        "status_429": stats["status_429"],
+        "status_5xx": stats["status_5xx"],
+        "failed_chunks": result.stdout.count("❌"),
+        "p50_s": round(percentile(latencies, 50), 2),
+        "p95_s": round(percentile(latencies, 95), 2),
+        "p99_s": round(percentile(latencies, 99), 2),
+        "ttft_p50_s": round(percentile(ttfts, 50), 2),
+        "ttft_p95_s": round(percentile(ttfts, 95), 2),
+        "tokens_per_s": round(sum(tps) / len(tps), 1) if tps else 0,
+        "exit_code": result.returncode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地 stub 服务上压测 04 阶段的报告生成")
+    parser.add_argument("--cases", type=int, default=40, help="合成病案数")
+    parser.add_argument("--case-chars", type=int, default=20000, help="普通病案 JSON 的大致字符数")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="逗号分隔的并发档位（04 的 --workers）")
+    parser.add_argument("--mode", choices=("serial", "mapreduce"), default="serial")
+    parser.add_argument("--pack-budget", type=int, default=0, help="04 的 --pack-budget，小病案打包请求的 token 预算（0 不打包）")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=1.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-429", type=float, default=0.02)
+    parser.add_argument("--error-5xx", type=float, default=0.01)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--output-chars", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix="loadtest_")
+    make_workspace(workspace, args.cases, args.case_chars, args.seed)
+
+    stub_args = []
+    for name in STUB_OPTIONS:
+        stub_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    stub = subprocess.Popen([sys.executable, STUB_SERVER, "--port", str(args.port)] + stub_args)
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    try:
+        for _ in range(50):
+            try:
+                http(base_url.replace("/v1", "/stats"))
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        print(f"📁 合成工作区：{workspace}（{args.cases} 个病案，模式 {args.mode}，打包预算 {args.pack_budget}）")
+        header = f"{'并发':>4} {'耗时s':>7} {'报告':>5} {'病案/分':>7} {'请求':>5} {'请求/s':>7} {'错误响应':>5} {'失败':>4} {'p50':>6} {'p95':>6} {'p99':>6} {'首字p50':>7} {'首字p95':>7} {'token/s':>8}"
+        print(header)
+        results = []
+        for workers in [int(w) for w in args.concurrency.split(",")]:
+            r = run_level(workspace, base_url, workers, args.mode, args.pack_budget)
+            results.append(r)
+            print(f"{r['workers']:>4} {r['seconds']:>7} {r['reports']:>5} {r['cases_per_min']:>7} {r['requests']:>5} "
+                  f"{r['requests_per_s']:>7} {r['server_errors']:>5} {r['failed_chunks']:>4} "
+                  f"{r['p50_s']:>6} {r['p95_s']:>6} {r['p99_s']:>6} "
+                  f"{r['ttft_p50_s']:>7} {r['ttft_p95_s']:>7} {r['tokens_per_s']:>8}", flush=True)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+            print(f"✅ 结果已写入：{args.output}")
+    finally:
+        stub.terminate()
+        stub.wait()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
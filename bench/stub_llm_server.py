@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ========== 本地 OpenAI 兼容 stub 服务 ==========
+# 实现 POST /v1/chat/completions，用于在无网络、不消耗额度的情况下压测 04 阶段：
+# 可配置延迟分布、429 / 5xx 注入、每分钟 token 上限，输出内容由请求内容确定（可复现）。
+# 请求带 stream=true 时以 SSE 分段返回（首字延迟约占总延迟的 TTFT_FRACTION）。
+# GET /stats 返回统计信息，POST /reset 清空统计。
+
+# 单份报告需明显长于 04 阶段的 PACK_MIN_REPORT_CHARS，否则打包输出会被判为拆分失败而全部回退单独请求
+CANNED_REPORT = """病案分析报告 — 病案号：{case_id}
+一、病例摘要
+患者入院后予以完善血常规、肝肾功能、电解质、凝血功能及影像学等相关检查，入院时生命体征平稳，
+各项检验指标总体处于可控范围，主要诊断明确，住院期间未出现严重并发症。
+二、诊断轨迹与诊疗过程分析
+入院评估提示需进一步检查以明确病因，检查结果与主要诊断相符；住院期间根据复查结果调整治疗方案，
+诊疗过程与指南推荐的路径基本一致，次要诊断均有相应检查或治疗支持。
+三、检验与检查结果深度分析
+部分指标入院时轻度异常，结合用药记录判断与药物治疗相关；治疗后复查结果趋于正常，
+关键指标的变化趋势与临床表现一致，未见提示病情加重的异常波动。
+四、治疗总结与效果评估
+治疗期间病情控制良好，用药剂量与疗程合理，未记录明显的药物不良反应，治疗目标基本达成。
+五、费用详细分析
+费用构成以治疗费与药费为主，检查检验费用次之，各项费用与诊疗过程相匹配，未见明显不合理收费。
+六、结论与出院状态
+患者病情稳定，达到出院标准，予以出院，嘱定期门诊随访并复查相关指标。
+"""
+TTFT_FRACTION = 0.3   # 流式返回时首字延迟占总延迟的比例
+STREAM_PIECE_CHARS = 20  # 流式返回时每段的字符数
+
+
+def estimate_tokens(text):
+    cjk = len(re.findall(r"[\u3400-\u9fff]", text))
+    return cjk + (len(text) - cjk) // 4
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.token_window = deque()  # (时间戳, token 数)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"requests": 0, "ok": 0, "status_429": 0, "status_5xx": 0,
+                          "input_tokens": 0, "output_tokens": 0, "latencies": []}
+            self.token_window.clear()
+
+    def sample_latency(self):
+        a = self.args
+        with self.lock:
+            if a.latency == "fixed":
+                return a.latency_mean
+            if a.latency == "uniform":
+                return self.rng.uniform(0, 2 * a.latency_mean)
+            if a.latency == "exponential":
+                return self.rng.expovariate(1 / a.latency_mean)
+            # lognormal：均值为 latency_mean，sigma 控制长尾
+            mu = math.log(a.latency_mean) - a.latency_sigma ** 2 / 2
+            return self.rng.lognormvariate(mu, a.latency_sigma)
+
+    def admit(self, tokens):
+        """返回 (状态码, Retry-After 秒数)；按注入概率与 TPM 限制决定是否拒绝"""
+        a = self.args
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            if roll < a.error_429:
+                self.stats["status_429"] += 1
+                return 429, 1
+            if roll < a.error_429 + a.error_5xx:
+                self.stats["status_5xx"] += 1
+                return self.rng.choice([500, 502, 503]), 0
+            if a.tpm:
+                now = time.time()
+                while self.token_window and now - self.token_window[0][0] > 60:
+                    self.token_window.popleft()
+                used = sum(t for _, t in self.token_window)
+                if used + tokens > a.tpm and self.token_window:
+                    self.stats["status_429"] += 1
+                    return 429, max(1, int(60 - (now - self.token_window[0][0])))
+                self.token_window.append((now, tokens))
+            return 200, 0
+
+    def record(self, latency, input_tokens, output_tokens):
+        with self.lock:
+            self.stats["ok"] += 1
+            self.stats["input_tokens"] += input_tokens
+            self.stats["output_tokens"] += output_tokens
+            self.stats["latencies"].append(latency)
+
+
+def canned_output(user_input, output_chars):
+    """按请求内容生成确定性的输出；打包请求按标记逐个病案输出"""
+    packed = list(dict.fromkeys(re.findall(r"=====REPORT (\d+) BEGIN=====", user_input)))
+    if packed:
+        return "\n".join(f"=====REPORT {c} BEGIN=====\n{CANNED_REPORT.format(case_id=c)}\n=====REPORT {c} END====="
+                         for c in packed)
+    match = re.search(r"病案号\W{0,4}0*(\d{1,6})", user_input)
+    case_id = match.group(1).zfill(6) if match else hashlib.sha256(user_input.encode()).hexdigest()[:6]
+    text = CANNED_REPORT.format(case_id=case_id)
+    return (text * (output_chars // len(text) + 1))[:output_chars]
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_stream(self, completion_id, model, content, latency):
+            """以 SSE 分段发送输出：先等待首字延迟，其余延迟均摊到各段之间"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            pieces = [content[i:i + STREAM_PIECE_CHARS] for i in range(0, len(content), STREAM_PIECE_CHARS)]
+            time.sleep(latency * TTFT_FRACTION)
+            gap = latency * (1 - TTFT_FRACTION) / max(1, len(pieces))
+            for i, piece in enumerate(pieces + [None]):
+                event = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": None if piece is not None else "stop",
+                                 "delta": {"content": piece} if piece is not None else {}}],
+                }
+                if i:
+                    time.sleep(gap)
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with state.lock:
+                    self.send_json(200, state.stats)
+            else:
+                self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if self.path.rstrip("/").endswith("/reset"):
+                state.reset()
+                self.send_json(200, {"ok": True})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "not found"}})
+                return
+
+            start = time.time()
+            request = json.loads(raw or b"{}")
+            user_input = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+            input_tokens = estimate_tokens(user_input)
+            status, retry_after = state.admit(input_tokens)
+            if status != 200:
+                time.sleep(min(0.05, state.args.latency_mean))
+                headers = {"Retry-After": str(retry_after)} if retry_after else None
+                self.send_json(status, {"error": {"message": f"injected {status}", "type": "stub_error"}}, headers)
+                return
+
+            latency = state.sample_latency()
+            content = canned_output(user_input, state.args.output_chars)
+            output_tokens = estimate_tokens(content)
+            completion_id = "chatcmpl-stub-" + hashlib.sha256(raw).hexdigest()[:12]
+            if request.get("stream"):
+                self.send_stream(completion_id, request.get("model", "stub"), content, latency)
+                state.record(time.time() - start, input_tokens, output_tokens)
+                return
+            time.sleep(latency)
+            state.record(time.time() - start, input_tokens, output_tokens)
+            self.send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                          "total_tokens": input_tokens + output_tokens},
+            })
+
+    return Handler
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 chat completions stub 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "exponential", "lognormal"), default="lognormal",
+                        help="每次成功请求的延迟分布")
+    parser.add_argument("--latency-mean", type=float, default=2.0, help="平均延迟（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 分布的 sigma（越大长尾越明显）")
+    parser.add_argument("--error-429", type=float, default=0.0, help="随机返回 429 的概率")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="随机返回 5xx 的概率")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟输入 token 上限，超出返回 429，0 表示不限")
+    parser.add_argument("--output-chars", type=int, default=1500, help="每次输出的字符数")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子（延迟与错误注入可复现）")
+    return parser
+
+
+def serve(args):
+    state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"🧪 stub 服务已启动：http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve(build_arg_parser().parse_args())
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+import blob_store  # noqa: E402
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_link_rerun_leaves_no_part(tmp_path):
+    store = str(tmp_path / "store")
+    blob = blob_store.put(store, write(str(tmp_path / "src.csv"), b"a,b\n1,2\n"))
+    dest = str(tmp_path / "dest.csv")
+    blob_store.link(blob, dest)
+    blob_store.link(blob, dest)
+    assert sorted(os.listdir(tmp_path)) == ["dest.csv", "src.csv", "store"]
+    assert os.path.samefile(blob, dest)
+
+
+def test_stage_rerun_is_idempotent_and_gc_reclaims(tmp_path):
+    store = str(tmp_path / "store")
+    out = tmp_path / "out"
+    out.mkdir()
+    src = write(str(tmp_path / "src.csv"), b"x\n")
+    for _ in range(3):
+        blob_store.stage(store, src, str(out / "src.csv"))
+    assert os.listdir(out) == ["src.csv"]
+    # 源文件、阶段目录各一个链接，库内一个
+    assert os.stat(out / "src.csv").st_nlink == 3
+
+    os.remove(src)
+    os.remove(out / "src.csv")
+    assert blob_store.gc(store)[0] == 1
+
+
+def test_link_replaces_different_content(tmp_path):
+    store = str(tmp_path / "store")
+    dest = str(tmp_path / "dest.csv")
+    blob_store.stage(store, write(str(tmp_path / "v1.csv"), b"v1"), dest)
+    blob_store.stage(store, write(str(tmp_path / "v2.csv"), b"v2"), dest)
+    with open(dest, "rb") as f:
+        assert f.read() == b"v2"
+    assert not os.path.exists(dest + ".part")
@@ -1,26 +1,24 @@
 import os
-import shutil
 import pandas as pd
+import blob_store
+from common import build_arg_parser
+from csv_reader import build_row_indexes
 
-# ========== 路径配置 ==========
-data_ori = "./data_00_ori"
-data_csv = "./data_01_csv"
-os.makedirs(data_csv, exist_ok=True)
 
-
-def excel_to_csv(data_ori, data_csv):
+def excel_to_csv(data_ori, data_csv, store):
+    hints = blob_store.load_digest_hints(data_ori)
     # 遍历目录下所有文件
     for filename in os.listdir(data_ori):
         file_path = os.path.join(data_ori, filename)
 
-        # ===== 情况 1：CSV 文件，直接拷贝 =====
+        # ===== 情况 1：CSV 文件，以硬链接引用文件库中的同一份内容 =====
         if filename.lower().endswith(".csv"):
             try:
                 target_path = os.path.join(data_csv, filename)
-                shutil.copy2(file_path, target_path)
-                print(f"📄 直接拷贝 CSV: {target_path}")
+                blob_store.stage(store, file_path, target_path, hints.get(filename))
+                print(f"📄 直接引用 CSV: {target_path}")
             except Exception as e:
-                print(f"❌ 拷贝 CSV 文件 {filename} 失败: {e}")
+                print(f"❌ 引用 CSV 文件 {filename} 失败: {e}")
             continue  # 跳过后续 Excel 处理逻辑
 
         # ===== 情况 2：Excel 文件，转换为 CSV =====
@@ -61,4 +59,14 @@ def excel_to_csv(data_ori, data_csv):
             print(f"⏭️ 跳过非 Excel/CSV 文件: {filename}")
 
 if __name__ == '__main__':
-    excel_to_csv(data_ori, data_csv)
+    parser = build_arg_parser("将原始 Excel / CSV 统一转换为 CSV")
+    parser.add_argument("--row-index", action="store_true", default=os.environ.get("CSV_ROW_INDEX") == "1",
+                        help="为各 CSV 建立病案号行索引，后续按病案子集 / 分片读取时只读命中的行")
+    args = parser.parse_args()
+    # ========== 路径配置 ==========
+    data_ori = os.path.join(args.workspace, "data_00_ori")
+    data_csv = os.path.join(args.workspace, "data_01_csv")
+    os.makedirs(data_csv, exist_ok=True)
+    excel_to_csv(data_ori, data_csv, blob_store.store_dir(args.workspace))
+    if args.row_index or args.cases:
+        print(f"🗂️ 已建立 {build_row_indexes(data_csv)} 个 CSV 的病案号行索引")
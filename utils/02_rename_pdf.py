@@ -1,13 +1,8 @@
 import os
 import re
-import shutil
 from PyPDF2 import PdfReader
-
-# ========== 1️⃣ 配置路径 ==========
-data_ori = "./data_00_ori"   # 原始 PDF 文件夹
-data_pdf = "./data_02_pdf"   # 输出文件夹
-
-os.makedirs(data_pdf, exist_ok=True)
+import blob_store
+from common import build_arg_parser, load_case_ids
 
 # ========== 2️⃣ 提取病案号函数 ==========
 def extract_case_id_from_pdf(pdf_path):
@@ -30,24 +25,55 @@ def extract_case_id_from_pdf(pdf_path):
     return None
 
 # ========== 3️⃣ 遍历目录并重命名 ==========
-for root, dirs, files in os.walk(data_ori):
-    for filename in files:
-        if filename.lower().endswith(".pdf"):
-            ori_path = os.path.join(root, filename)
-            case_id = extract_case_id_from_pdf(ori_path)
-
-            if case_id:
-                new_filename = f"{case_id}.pdf"
-                new_path = os.path.join(data_pdf, new_filename)
-
-                # 如果已存在同名文件，可以在此加逻辑避免覆盖
-                if os.path.exists(new_path):
-                    print(f"⚠️ 病案号 {case_id} 已存在，跳过 {filename}")
-                    continue
-
-                shutil.copy2(ori_path, new_path)
-                print(f"✅ 已提取病案号 {case_id} → {new_filename}")
-            else:
-                print(f"❌ 未找到病案号：{ori_path}")
-
-print(f"\n🎉 处理完成！所有新文件保存在：{os.path.abspath(data_pdf)}")
+def rename_pdfs(data_ori, data_pdf, store, case_ids=None):
+    """
+    遍历原始目录提取病案号并重命名。
+    指定 case_ids 时只保留这些病案，且全部找到后立即停止扫描。
+    输出文件是文件库中同一内容的硬链接，不复制 PDF。
+    """
+    remaining = set(case_ids) if case_ids else None
+    hints = blob_store.load_digest_hints(data_ori)
+    for root, dirs, files in os.walk(data_ori):
+        for filename in files:
+            if filename.lower().endswith(".pdf"):
+                ori_path = os.path.join(root, filename)
+                case_id = extract_case_id_from_pdf(ori_path)
+
+                if case_id:
+                    if case_ids is not None and case_id not in case_ids:
+                        continue
+
+                    new_filename = f"{case_id}.pdf"
+                    new_path = os.path.join(data_pdf, new_filename)
+
+                    # 如果已存在同名文件，可以在此加逻辑避免覆盖
+                    if os.path.exists(new_path):
+                        print(f"⚠️ 病案号 {case_id} 已存在，跳过 {filename}")
+                    else:
+                        # 先建临时链接再改名，流水线模式下其他阶段不会读到不完整的 PDF
+                        blob_store.stage(store, ori_path, new_path, hints.get(os.path.relpath(ori_path, data_ori)))
+                        print(f"✅ 已提取病案号 {case_id} → {new_filename}")
+
+                    if remaining is not None:
+                        remaining.discard(case_id)
+                        if not remaining:
+                            print("🎯 指定病案号已全部找到，停止扫描。")
+                            return remaining
+                else:
+                    print(f"❌ 未找到病案号：{ori_path}")
+    return remaining
+
+
+if __name__ == "__main__":
+    args = build_arg_parser("从 PDF 中提取病案号并重命名").parse_args()
+
+    # ========== 1️⃣ 配置路径 ==========
+    data_ori = os.path.join(args.workspace, "data_00_ori")   # 原始 PDF 文件夹
+    data_pdf = os.path.join(args.workspace, "data_02_pdf")   # 输出文件夹
+    os.makedirs(data_pdf, exist_ok=True)
+
+    missing = rename_pdfs(data_ori, data_pdf, blob_store.store_dir(args.workspace), load_case_ids(args.cases))
+    if missing:
+        print(f"⚠️ 以下病案号未找到对应 PDF：{', '.join(sorted(missing))}")
+
+    print(f"\n🎉 处理完成！所有新文件保存在：{os.path.abspath(data_pdf)}")
@@ -2,11 +2,21 @@ import pandas as pd
 import json
 import os
 import numpy as np
+import time
+from common import build_arg_parser, load_case_ids
+from csv_reader import CSV_ENGINES, DEFAULT_CSV_ENGINE, read_tables
 
-# ========== 1️⃣ 文件路径（请修改为你自己的） ==========
-input_dir = "./data_01_csv"  # 输入文件夹
-output_dir = "./data_03_json"  # 输出文件夹
-headers_file = "./conf/headers.json"  # headers.json 文件路径
+# ========== 命令行参数 ==========
+parser = build_arg_parser("合并各表 CSV 为每个病案号一个 JSON")
+parser.add_argument("--csv-engine", choices=CSV_ENGINES, default=DEFAULT_CSV_ENGINE,
+                    help="pandas（默认）；auto：优先 pyarrow 多线程读取，失败时回退 pandas")
+args = parser.parse_args()
+CASE_IDS = load_case_ids(args.cases)
+
+# ========== 1️⃣ 文件路径（相对于工作区根目录） ==========
+input_dir = os.path.join(args.workspace, "data_01_csv")  # 输入文件夹
+output_dir = os.path.join(args.workspace, "data_03_json")  # 输出文件夹
+headers_file = os.path.join(args.workspace, "conf", "headers.json")  # headers.json 文件路径
 
 file_检查 = f"{input_dir}/检查信息.csv"
 file_检验 = f"{input_dir}/检验信息.csv"
@@ -47,32 +57,27 @@ def remove_nan_values(obj):
     else:
         return obj
 
-# ========== 3️⃣ 自动识别编码读取 CSV ==========
-def read_csv_auto(path):
-    encodings = ["utf-8-sig", "gbk", "gb2312", "utf-8"]
-    for enc in encodings:
-        try:
-            df = pd.read_csv(path, encoding=enc, low_memory=False)
-            return df
-        except Exception:
-            continue
-    raise ValueError(f"无法读取文件：{path}")
+# ========== 3️⃣ 四张表并发读取（病案号统一为六位数字） ==========
+TABLES = {
+    "检查信息": file_检查,
+    "检验信息": file_检验,
+    "病案首页": file_病案,
+    "医嘱信息": file_医嘱,
+}
 
 # ========== 4️⃣ 读取数据 ==========
-df_check = read_csv_auto(file_检查)
-df_test = read_csv_auto(file_检验)
-df_case = read_csv_auto(file_病案)
-df_order = read_csv_auto(file_医嘱)
-
-# ========== ✅ 统一病案号为六位数字 ==========
-def normalize_case_id(series):
-    """将病案号统一为6位数字（前补0）"""
-    return series.astype(str).str.strip().str.zfill(6)
-
-df_check["病案号"] = normalize_case_id(df_check["病案号"])
-df_test["病案号"] = normalize_case_id(df_test["病案号"])
-df_case["病案号"] = normalize_case_id(df_case["病案号"])
-df_order["病案号"] = normalize_case_id(df_order["病案号"])
+start_time = time.time()
+dfs = read_tables(
+    TABLES,
+    usecols={name: set(FIELDS.get(name, [])) | {"病案号"} for name in TABLES},
+    case_ids=CASE_IDS,
+    engine=args.csv_engine,
+)
+df_check = dfs["检查信息"]
+df_test = dfs["检验信息"]
+df_case = dfs["病案首页"]
+df_order = dfs["医嘱信息"]
+print(f"📥 四张表读取完成，用时 {time.time() - start_time:.1f} 秒（引擎：{args.csv_engine}）")
 
 # ========== 5️⃣ 获取所有病案号 ==========
 all_case_ids = set(
@@ -85,6 +90,22 @@ all_case_ids = set(
     df_order["病案号"]
 )
 
+if CASE_IDS is not None:
+    missing = CASE_IDS - all_case_ids
+    if missing:
+        print(f"⚠️ 以下病案号在各表中均未找到：{', '.join(sorted(missing))}")
+
+# 按病案号预先分组，避免每个病案都全表扫描
+def group_by_case(df):
+    return {case_id: sub for case_id, sub in df.groupby("病案号", sort=False)}
+
+
+groups_check = group_by_case(df_check)
+groups_test = group_by_case(df_test)
+groups_case = group_by_case(df_case)
+groups_order = group_by_case(df_order)
+EMPTY = pd.DataFrame()
+
 # ========== 6️⃣ 生成输出文件夹 ==========
 os.makedirs(output_dir, exist_ok=True)
 
@@ -98,7 +119,7 @@ def build_patient_json(case_id):
     }
 
     # 病案首页
-    df_case_sub = df_case[df_case["病案号"] == case_id]
+    df_case_sub = groups_case.get(case_id, EMPTY)
     if not df_case_sub.empty:
         cols = [c for c in FIELDS["病案首页"] if c in df_case_sub.columns]
         # 先转换为字典，然后手动处理NaN值
@@ -108,7 +129,7 @@ def build_patient_json(case_id):
                             if not (isinstance(v, float) and np.isnan(v))}
     
     # 检查信息
-    df_check_sub = df_check[df_check["病案号"] == case_id]
+    df_check_sub = groups_check.get(case_id, EMPTY)
     if not df_check_sub.empty:
         cols = [c for c in FIELDS["检查信息"] if c in df_check_sub.columns]
         # 删除病案号字段（保留其他字段）
@@ -124,7 +145,7 @@ def build_patient_json(case_id):
                 record["检查信息"].append(cleaned_rec)
     
     # 检验信息
-    df_test_sub = df_test[df_test["病案号"] == case_id]
+    df_test_sub = groups_test.get(case_id, EMPTY)
     if not df_test_sub.empty:
         cols = [c for c in FIELDS["检验信息"] if c in df_test_sub.columns]
         # 删除病案号字段（保留其他字段）
@@ -140,7 +161,7 @@ def build_patient_json(case_id):
                 record["检验信息"].append(cleaned_rec)
     
     # 医嘱信息
-    df_order_sub = df_order[df_order["病案号"] == case_id]
+    df_order_sub = groups_order.get(case_id, EMPTY)
     if not df_order_sub.empty:
         cols = [c for c in FIELDS["医嘱信息"] if c in df_order_sub.columns]
         # 删除病案号字段（保留其他字段）
@@ -161,8 +182,10 @@ def build_patient_json(case_id):
 for case_id in sorted(all_case_ids):
     patient_json = build_patient_json(case_id)
     out_path = os.path.join(output_dir, f"{case_id}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
+    # 先写临时文件再改名，流水线模式下其他阶段不会读到不完整的 JSON
+    with open(out_path + ".part", "w", encoding="utf-8") as f:
         json.dump(patient_json, f, ensure_ascii=False, indent=2)
+    os.replace(out_path + ".part", out_path)
     print(f"✅ 已生成：{out_path}")
 
 print(f"\n🎉 所有病案号已成功导出到文件夹：{os.path.abspath(output_dir)}")
\ No newline at end of file
@@ -0,0 +1,228 @@
+import csv
+import json
+import os
+from common import build_arg_parser, load_case_ids, time_key
+
+# ========== 压缩配置 ==========
+ITEM_FIELDS = ["检验项目名称", "检验项目"]  # 检验项目标识，按顺序取第一个非空字段
+DATE_FIELDS = ["采集时间", "报告日期"]      # 结果时间，按顺序取第一个非空字段
+GROUP_FIELDS = ["单位", "标本"]             # 与项目一起作为序列分组键
+NORMAL_FLAGS = {"", "正常", "N", "n", "-", "阴性", "阴性(-)", "(-)"}  # 视为正常的检验标志
+LIST_TABLES = ["检查信息", "检验信息", "医嘱信息"]
+
+
+def first_value(rec, fields):
+    return first_field(rec, fields)[1]
+
+
+def first_field(rec, fields):
+    """返回 (字段名, 值)：按顺序取第一个非空字段"""
+    for f in fields:
+        v = rec.get(f)
+        if v not in (None, ""):
+            return f, str(v).strip()
+    return None, ""
+
+
+def dedup_records(records):
+    """删除完全相同的重复记录，保留首次出现的顺序"""
+    seen = set()
+    result = []
+    for rec in records:
+        key = json.dumps(rec, ensure_ascii=False, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            result.append(rec)
+    return result
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_abnormal(point):
+    flag = point[2] if len(point) > 2 else ""
+    return flag not in NORMAL_FLAGS or str(point[1]).startswith("阳性")
+
+
+def select_points(points):
+    """仅保留异常值以及首次、末次、最大、最小结果"""
+    keep = {0, len(points) - 1}
+    numeric = [(to_number(p[1]), i) for i, p in enumerate(points) if to_number(p[1]) is not None]
+    if numeric:
+        keep.add(min(numeric)[1])
+        keep.add(max(numeric)[1])
+    keep |= {i for i, p in enumerate(points) if is_abnormal(p)}
+    return [points[i] for i in sorted(keep)]
+
+
+def same_day(a, b):
+    ka, kb = time_key(a), time_key(b)
+    return ka[0] == kb[0] == 0 and ka[1][:3] == kb[1][:3]
+
+
+def compact_lab_records(records, abnormal_only=False):
+    """
+    将逐行的检验记录按项目分组为时间序列：
+    {"项目": 名称, "单位": ..., "标本": ..., "结果": [[时间, 结果, 标志], ...]}
+    另一个时间字段（通常为报告日期）与结果时间同一天时省略，否则作为结果点的第 4 列，
+    列名记在序列的“结果列”中；序列内都相同时提升为序列属性。
+    其余字段不丢弃：同一序列内取值都相同的作为序列属性，否则附在对应结果点末尾（{字段: 值}）。
+    abnormal_only 时每个项目只保留异常值及首末、极值点，并记录省略条数。
+    """
+    series = {}
+    for rec in records:
+        item_field, item = first_field(rec, ITEM_FIELDS)
+        group = tuple(first_value(rec, [f]) for f in GROUP_FIELDS)
+        key = (item, group)
+        if key not in series:
+            entry = {"项目": item}
+            for f, v in zip(GROUP_FIELDS, group):
+                if v:
+                    entry[f] = v
+            entry["结果"] = []
+            series[key] = entry
+        date_field, date = first_field(rec, DATE_FIELDS)
+        second_field, second = first_field(rec, [f for f in DATE_FIELDS if f != date_field])
+        if second and same_day(date, second):
+            second = ""
+        value_field, value = first_field(rec, ["检验结果", "阴阳性"])
+        flag_field, flag = first_field(rec, ["检验标志"])
+        if not flag and value_field == "检验结果":
+            flag_field, flag = first_field(rec, ["阴阳性"])
+        used = {item_field, value_field, flag_field, *DATE_FIELDS, *GROUP_FIELDS}
+        extras = {k: v for k, v in rec.items() if k not in used and v not in (None, "")}
+        if second:
+            series[key].setdefault("第二时间", second_field)
+        series[key]["结果"].append((date, value, flag, second, extras))
+
+    compacted = []
+    for entry in series.values():
+        points = sorted(entry["结果"], key=lambda p: time_key(p[0]))
+        second_field = entry.pop("第二时间", None)
+        # 序列内取值恒定的其余字段（含第二时间）提升为序列属性
+        shared = {}
+        if points:
+            if second_field and all(p[3] == points[0][3] for p in points):
+                shared[second_field] = points[0][3]
+                second_field = None
+            for k, v in points[0][4].items():
+                if k not in entry and all(p[4].get(k) == v for p in points):
+                    shared[k] = v
+        entry.pop("结果")
+        entry.update(shared)  # 序列属性排在“结果”之前，便于阅读
+        if second_field:
+            entry["结果列"] = ["时间", "结果", "标志", second_field]
+        result = []
+        for date, value, flag, second, extras in points:
+            point = [date, value]
+            rest = {k: v for k, v in extras.items() if k not in shared}
+            if second_field is None:
+                second = ""
+            if flag or second or rest:
+                point.append(flag)
+            if second or rest:
+                point.append(second)
+            if rest:
+                point.append(rest)
+            result.append(point)
+        # 同一时间的相同结果只保留一次
+        entry["结果"] = [p for i, p in enumerate(result) if i == 0 or p != result[i - 1]]
+        if abnormal_only:
+            keep_abnormal(entry)
+        compacted.append(entry)
+    return compacted
+
+
+def keep_abnormal(entry):
+    """对单个项目的序列只保留异常值及首末、极值点，并记录省略条数"""
+    points = entry["结果"]
+    if "省略正常结果数" in entry or len(points) <= 2:
+        return
+    kept = select_points(points)
+    if len(kept) < len(points):
+        entry["省略正常结果数"] = len(points) - len(kept)
+    entry["结果"] = kept
+
+
+def is_compacted(records):
+    return bool(records) and all(isinstance(r, dict) and "结果" in r and "项目" in r for r in records)
+
+
+def compact_case(record, abnormal_only=False):
+    for name in LIST_TABLES:
+        if isinstance(record.get(name), list):
+            record[name] = dedup_records(record[name])
+    labs = record.get("检验信息") or []
+    if labs and not is_compacted(labs):
+        record["检验信息"] = compact_lab_records(labs, abnormal_only)
+    elif labs and abnormal_only:
+        # 已压缩过的文件再次以 --abnormal-only 运行时，只做异常值筛选
+        for entry in labs:
+            keep_abnormal(entry)
+    return record
+
+
+def compact_file(path, abnormal_only=False):
+    """原地压缩单个病案 JSON，返回 (压缩前字符数, 压缩后字符数)"""
+    with open(path, "r", encoding="utf-8") as f:
+        original = f.read()
+    record = compact_case(json.loads(original), abnormal_only)
+    compacted = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(compacted)
+    os.replace(tmp_path, path)
+    return len(original), len(compacted)
+
+
+def main(json_dir, report_path, case_ids=None, abnormal_only=False):
+    rows = []
+    for filename in sorted(os.listdir(json_dir)):
+        if not filename.endswith(".json"):
+            continue
+        case_id = os.path.splitext(filename)[0]
+        if case_ids is not None and case_id not in case_ids:
+            continue
+
+        before, after = compact_file(os.path.join(json_dir, filename), abnormal_only)
+        ratio = after / before if before else 1.0
+        rows.append({
+            "病案号": case_id,
+            "压缩前字符数": before,
+            "压缩后字符数": after,
+            "压缩比": round(ratio, 3),
+        })
+        print(f"🗜️ [{case_id}] {before:,} → {after:,} 字符（{ratio:.1%}）")
+
+    if not rows:
+        print("⚠️ 没有找到需要压缩的 JSON 文件。")
+        return
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    before = sum(r["压缩前字符数"] for r in rows)
+    after = sum(r["压缩后字符数"] for r in rows)
+    print(f"\n🎉 共压缩 {len(rows)} 个病案：{before:,} → {after:,} 字符（{after / before:.1%}）")
+    print(f"📊 压缩报告：{report_path}")
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser("压缩病案 JSON 中的检验结果：去重并按项目整理为时间序列")
+    parser.add_argument("--abnormal-only", action="store_true",
+                        default=os.environ.get("LAB_ABNORMAL_ONLY") == "1",
+                        help="每个检验项目只保留异常值及首次、末次、最大、最小结果")
+    args = parser.parse_args()
+    main(
+        os.path.join(args.workspace, "data_03_json"),
+        os.path.join(args.workspace, "temp", "compaction_report.csv"),
+        load_case_ids(args.cases),
+        args.abnormal_only,
+    )
@@ -1,6 +1,12 @@
 import os
 import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
+from common import build_arg_parser, load_case_ids, time_key
 
 # ========== 用户配置 ==========
 INPUT_JSON_DIR = "./data_03_json"
@@ -8,14 +14,15 @@ PDF_DIR = "./data_02_pdf"  # 新增 PDF 对应目录
 PROMPT_FILE = "./conf/prompt.txt"
 OUTPUT_DIR = "./data_04_summary_txt"
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-API_KEY = "sk-7xet3afg2b7fumjl"
-BASE_URL = "https://cloud.infini-ai.com/maas/v1"
+API_KEY = os.environ.get("LLM_API_KEY", "sk-7xet3afg2b7fumjl")
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://cloud.infini-ai.com/maas/v1")  # 压测时指向本地 stub 服务
 MODEL_NAME = "gpt-4o"
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))  # 429 / 5xx 时客户端自动重试次数
 
 CHUNK_SIZE = 120000
 CONTEXT_SNIPPET_LEN = 2000
+STREAM = os.environ.get("LLM_STREAM", "1") != "0"  # 流式接收输出，边生成边写入部分报告
+METRICS_FILE = "./temp/llm_requests.jsonl"           # 每次请求的首字延迟、输出速度
 # ==================================
 
 
@@ -39,40 +46,140 @@ def remove_repeated_section(prev_text, new_text):
     return new_text
 
 
-def main():
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+# ========== 生成模式配置 ==========
+GENERATION_MODES = ("serial", "mapreduce")
+MAP_SECTION_SIZE = 30000  # map 阶段每个分区的最大字符数
+MAP_WORKERS = 4           # 单个病案内并发的 map 请求数
+TIME_FIELDS = ["报告时间", "采集时间", "报告日期", "医嘱开始时间"]  # 用于标注时间窗的字段
 
-    with open(PROMPT_FILE, "r", encoding="utf-8") as f:
-        prompt_template = f.read()
+SYSTEM_PROMPT = "你是一名具有30年以上临床经验的主任医师。请基于上下文续写病案总结报告，禁止重复前文内容。"
+MAP_SYSTEM_PROMPT = "你是一名具有30年以上临床经验的主任医师。请从给定的病案数据片段中准确提取临床要点，不做推测。"
+REDUCE_SYSTEM_PROMPT = "你是一名具有30年以上临床经验的主任医师。请基于各部分数据要点撰写完整的病案总结报告。"
 
-    for filename in os.listdir(INPUT_JSON_DIR):
-        if not filename.endswith(".json"):
-            continue
 
-        # ===== 新增逻辑：检查对应 PDF 是否存在 =====
-        base_name = os.path.splitext(filename)[0]
-        pdf_path = os.path.join(PDF_DIR, base_name + ".pdf")
-        if not os.path.exists(pdf_path):
-            print(f"⚠️ 跳过：{filename} —— 未找到对应 PDF：{base_name}.pdf")
+def make_client():
+    return OpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=MAX_RETRIES)
+
+
+_metrics_lock = threading.Lock()
+
+
+def record_metrics(label, ttft, seconds, output):
+    """记录单次请求的首字延迟与输出速度，追加到 METRICS_FILE"""
+    tokens = count_tokens(output)
+    gen_seconds = seconds - ttft if STREAM else seconds  # 非流式时无法区分首字与生成耗时
+    tps = tokens / gen_seconds if gen_seconds > 0 else 0.0
+    print(f"  ⚡ {label}首字 {ttft:.1f} 秒，共 {seconds:.1f} 秒，{tokens} token（{tps:.1f} token/秒）", flush=True)
+    row = {"label": label.strip(), "ttft_s": round(ttft, 3), "seconds": round(seconds, 3),
+           "output_tokens": tokens, "tokens_per_s": round(tps, 1), "stream": STREAM, "time": round(time.time())}
+    with _metrics_lock:
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        with open(METRICS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def chat(client, system_prompt, user_input, on_token=None, label=""):
+    """
+    发送一次对话请求并返回完整输出。
+    流式模式下每收到一段内容即调用 on_token(text)，供调用方追加写入部分报告。
+    """
+    start = time.time()
+    response = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_input}
+        ],
+        temperature=0.2,
+        stream=STREAM,
+    )
+    if not STREAM:
+        output = response.choices[0].message.content
+        seconds = time.time() - start
+        record_metrics(label, seconds, seconds, output)
+        return output.strip()
+
+    parts, ttft = [], None
+    for event in response:
+        if not event.choices:
             continue
-        # ========================================
+        text = event.choices[0].delta.content
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.time() - start
+        parts.append(text)
+        if on_token is not None:
+            on_token(text)
+    seconds = time.time() - start
+    output = "".join(parts)
+    record_metrics(label, seconds if ttft is None else ttft, seconds, output)
+    return output.strip()
 
-        json_path = os.path.join(INPUT_JSON_DIR, filename)
-        with open(json_path, "r", encoding="utf-8") as f:
-            data_json = f.read()
 
-        print(f"📄 正在处理：{filename}")
+class ReportProgress:
+    """
+    单个病案的生成进度：
+    - 流式输出实时追加到 <病案号>.txt.part，生成过程中即可查看；
+    - 每完成一段（串行分块 / map 分区）写入检查点 .<病案号>.progress.json，
+      中断或出错后重新运行时跳过已完成的段，已付费的输出不会丢弃。
+    输入数据、Prompt 或生成模式变化时检查点自动作废。
+    """
 
-        chunks = split_text(data_json, CHUNK_SIZE)
-        previous_summary = ""
-        full_output = ""
+    def __init__(self, base_name, fingerprint):
+        self.part_path = os.path.join(OUTPUT_DIR, base_name + ".txt.part")
+        self.state_path = os.path.join(OUTPUT_DIR, f".{base_name}.progress.json")
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.outputs = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("fingerprint") == fingerprint:
+                    self.outputs = state.get("outputs", {})
+            except (OSError, ValueError):
+                pass
+        if not self.outputs and os.path.exists(self.part_path):
+            # 检查点无效时，上次残留的部分报告也不再对应当前输入
+            os.remove(self.part_path)
 
-        for idx, chunk in enumerate(chunks, 1):
-            print(f"  🔹 分块 {idx}/{len(chunks)} 请求中...")
+    def get(self, key):
+        return self.outputs.get(str(key))
+
+    def reset_part(self, text=""):
+        """部分报告回到已完成的内容（丢弃被中断分段的半截输出）"""
+        with self.lock:
+            with open(self.part_path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+    def append(self, text):
+        with self.lock:
+            with open(self.part_path, "a", encoding="utf-8") as f:
+                f.write(text)
 
-            user_input = f"""
-以下为病案JSON的第 {idx} 段（共 {len(chunks)} 段）。
+    def complete(self, key, text):
+        with self.lock:
+            self.outputs[str(key)] = text
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": self.fingerprint, "outputs": self.outputs}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+
+    def finish(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def progress_fingerprint(mode, data_json, prompt_template):
+    key = json.dumps([mode, CHUNK_SIZE, MAP_SECTION_SIZE, data_json, prompt_template], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def build_serial_input(idx, total, previous_summary, chunk, prompt_template):
+    return f"""
+以下为病案JSON的第 {idx} 段（共 {total} 段）。
 请【仅续写后续内容】，不要重复前文标题或章节。
 不要重新生成“病案总结报告”标题或前面章节。
 
@@ -89,37 +196,523 @@ def main():
 {prompt_template}
 """
 
-            try:
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "你是一名具有30年以上临床经验的主任医师。请基于上下文续写病案总结报告，禁止重复前文内容。"
-                        },
-                        {"role": "user", "content": user_input}
-                    ],
-                    temperature=0.2,
-                )
-
-                output = response.choices[0].message.content.strip()
-                cleaned = remove_repeated_section(full_output, output)
-
-                full_output += "\n\n" + cleaned
-                previous_summary = full_output[-CONTEXT_SNIPPET_LEN:]
 
+def generate_report_serial(client, data_json, prompt_template, progress=None):
+    """
+    串行模式：逐段请求，每段携带前文末尾作为上下文。
+    某块出错即停止并返回 None（病案未完成）；传入 progress 时保留已完成分块的进度，续跑时跳过。
+    """
+    chunks = split_text(data_json, CHUNK_SIZE)
+    previous_summary = ""
+    full_output = ""
+
+    for idx, chunk in enumerate(chunks, 1):
+        done = progress.get(idx) if progress else None
+        if done is not None:
+            print(f"  ⏭️ 分块 {idx}/{len(chunks)} 已完成，沿用上次输出")
+        else:
+            print(f"  🔹 分块 {idx}/{len(chunks)} 请求中...")
+            user_input = build_serial_input(idx, len(chunks), previous_summary, chunk, prompt_template)
+            if progress:
+                progress.reset_part(full_output.strip() + "\n\n" if full_output else "")
+            try:
+                output = chat(client, SYSTEM_PROMPT, user_input,
+                              on_token=progress.append if progress else None, label=f"分块 {idx}/{len(chunks)} ")
             except Exception as e:
                 print(f"❌ 分块 {idx} 出错：{e}")
-                continue
+                if progress:
+                    print(f"  ⏸️ 已保存前 {idx - 1} 块的进度，重新运行将从第 {idx} 块继续")
+                return None
+            done = remove_repeated_section(full_output, output)
+            if progress:
+                progress.complete(idx, done)
+
+        full_output += "\n\n" + done
+        previous_summary = full_output[-CONTEXT_SNIPPET_LEN:]
+
+    return full_output.strip()
+
+
+def record_time(rec):
+    """记录的排序时间：按 TIME_FIELDS 顺序取第一个非空时间字段，均为空时返回空串"""
+    for f in TIME_FIELDS:
+        if rec.get(f):
+            return str(rec[f])
+    return ""
+
+
+def time_range(records):
+    """取分区内记录的起止时间，用于提示模型该分区对应的时间窗"""
+    times = [str(rec[f]) for rec in records for f in TIME_FIELDS if rec.get(f)]
+    if not times:
+        return ""
+    return f"{min(times, key=time_key)} 至 {max(times, key=time_key)}"
+
+
+def split_sections(record):
+    """
+    将病案 JSON 按数据表拆分为互相独立的分区；
+    03 阶段按 CSV 行序输出记录，这里先按记录时间排序（无时间的记录排在最后，同一时间保持原顺序），
+    再将大表切成不超过 MAP_SECTION_SIZE 字符、互不重叠的时间窗。
+    """
+    sections = []
+    for name in ["检查信息", "检验信息", "医嘱信息"]:
+        records = sorted(record.get(name) or [], key=lambda rec: time_key(record_time(rec)))
+        window, size = [], 0
+        for rec in records:
+            rec_size = len(json.dumps(rec, ensure_ascii=False))
+            if window and size + rec_size > MAP_SECTION_SIZE:
+                sections.append((name, window))
+                window, size = [], 0
+            window.append(rec)
+            size += rec_size
+        if window:
+            sections.append((name, window))
+    return sections
+
+
+def build_map_input(basic_info, name, records, idx, total):
+    span = time_range(records)
+    return f"""
+以下为病案的【{name}】数据（第 {idx} 部分，共 {total} 部分{"，时间范围：" + span if span else ""}）。
+请提取其中与病案总结报告相关的全部要点：关键日期、检查/检验结果及数值、异常标志、药物名称与剂量变化、治疗起止时间等。
+要求：按时间顺序以条目形式输出，只陈述数据中的事实，不要撰写报告正文，不要遗漏异常值。
+
+——患者基本信息（供参考）——
+{basic_info}
+
+——本部分JSON数据——
+{json.dumps(records, ensure_ascii=False, indent=2)}
+"""
+
+
+def build_reduce_input(basic_info, notes, prompt_template):
+    notes_text = "\n\n".join(f"【{title}】\n{text}" for title, text in notes)
+    return f"""
+以下为同一病案的病案首页数据，以及从检查、检验、医嘱数据各部分提取的要点（已按数据表和时间窗整理）。
+请据此一次性撰写完整报告，各章节只出现一次。
+
+——病案首页JSON数据——
+{basic_info}
+
+——各部分数据要点——
+{notes_text}
+
+{prompt_template}
+"""
+
+
+def build_map_requests(data_json):
+    """返回 (病案首页JSON, [(分区标题, map 请求内容), ...])"""
+    record = json.loads(data_json)
+    basic_info = json.dumps(record.get("病案首页", {}), ensure_ascii=False, indent=2)
+    sections = split_sections(record)
+    totals = {}
+    for name, _ in sections:
+        totals[name] = totals.get(name, 0) + 1
+
+    requests, seen = [], {}
+    for name, records in sections:
+        seen[name] = seen.get(name, 0) + 1
+        title = f"{name} {seen[name]}/{totals[name]}"
+        requests.append((title, build_map_input(basic_info, name, records, seen[name], totals[name])))
+    return basic_info, requests
+
+
+def generate_report_mapreduce(client, data_json, prompt_template, map_workers=MAP_WORKERS, progress=None):
+    """
+    map-reduce 模式：各数据表 / 时间窗并发提取要点（map），
+    再用一次请求按 prompt 结构汇总成报告（reduce），单个病案约两轮请求耗时。
+    任一分区失败时不做 reduce，返回 None（病案未完成）；传入 progress 时已完成的分区保留，续跑时直接沿用。
+    """
+    if len(data_json) <= CHUNK_SIZE:
+        # 单段即可容纳，直接一次生成
+        return generate_report_serial(client, data_json, prompt_template, progress)
+
+    basic_info, map_requests = build_map_requests(data_json)
+    notes = [None] * len(map_requests)
+    pending = []
+    for i, (title, _) in enumerate(map_requests):
+        done = progress.get(i) if progress else None
+        if done is not None:
+            notes[i] = (title, done)
+        else:
+            pending.append(i)
+    print(f"  🔹 map 阶段：{len(pending)} 个分区并发请求中..."
+          + (f"（{len(map_requests) - len(pending)} 个分区已完成）" if len(pending) < len(map_requests) else ""))
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, map_workers)) as pool:
+        futures = {pool.submit(chat, client, MAP_SYSTEM_PROMPT, map_requests[i][1], None, f"分区 {map_requests[i][0]} "): i
+                   for i in pending}
+        for future in as_completed(futures):
+            i = futures[future]
+            title = map_requests[i][0]
+            try:
+                notes[i] = (title, future.result())
+                if progress:
+                    progress.complete(i, notes[i][1])
+            except Exception as e:
+                failed += 1
+                print(f"❌ 分区 {title} 出错：{e}")
+    if failed:
+        # 缺少任一分区的要点都会让报告静默遗漏临床内容，整个病案视为未完成
+        print(f"  ⏸️ {failed} 个分区失败，不做汇总"
+              + (f"；已保存 {len(map_requests) - failed} 个分区的进度，重新运行将只请求失败的分区" if progress else ""))
+        return None
+
+    print(f"  🔹 reduce 阶段：汇总 {len(notes)} 个分区要点...")
+    if progress:
+        progress.reset_part()
+    return chat(client, REDUCE_SYSTEM_PROMPT, build_reduce_input(basic_info, notes, prompt_template),
+                on_token=progress.append if progress else None, label="reduce ")
+
+
+# ========== 多病案打包请求 ==========
+PACK_MAX_CASES = 4            # 每个包最多的病案数（受模型单次输出长度限制）
+PACK_MIN_REPORT_CHARS = 200   # 拆分后单份报告的最小长度，过短视为解析失败
+PACK_SYSTEM_PROMPT = "你是一名具有30年以上临床经验的主任医师。请为每位患者分别撰写独立的病案总结报告，不同患者的信息不得混用。"
+PACK_BEGIN = "=====REPORT {case_id} BEGIN====="
+PACK_END = "=====REPORT {case_id} END====="
+
+
+def read_case_json(filename):
+    with open(os.path.join(INPUT_JSON_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def plan_packs(filenames, pack_budget, prompt_template):
+    """
+    将单段即可容纳的小病案按输入 token 预算依次装包。
+    预算按实际发送的内容计：系统提示词 + build_pack_input 生成的完整输入（含报告要求、标记与各病案数据）。
+    返回 (packs, singles)：packs 为文件名列表的列表（每包至少 2 个病案），singles 单独请求。
+    """
+    if pack_budget <= 0:
+        return [], list(filenames)
+    system_tokens = count_tokens(PACK_SYSTEM_PROMPT)
+    packs, singles, current, current_cases = [], [], [], []
+    for filename in filenames:
+        data_json = read_case_json(filename)
+        if len(data_json) > CHUNK_SIZE or count_tokens(data_json) > pack_budget // 2:
+            singles.append(filename)
+            continue
+        case = (os.path.splitext(filename)[0], data_json)
+        if current and (len(current) >= PACK_MAX_CASES or system_tokens + count_tokens(
+                build_pack_input(current_cases + [case], prompt_template)) > pack_budget):
+            packs.append(current)
+            current, current_cases = [], []
+        current.append(filename)
+        current_cases.append(case)
+    if current:
+        packs.append(current)
+    singles += [p[0] for p in packs if len(p) == 1]
+    return [p for p in packs if len(p) > 1], singles
+
+
+def build_pack_input(cases, prompt_template):
+    """cases：[(病案号, JSON 文本), ...]"""
+    blocks = "\n\n".join(f"<<<病案 {case_id}>>>\n{data_json}\n<<<病案 {case_id} 结束>>>"
+                          for case_id, data_json in cases)
+    markers = "\n".join(f"{PACK_BEGIN.format(case_id=case_id)}\n（{case_id} 的完整报告）\n{PACK_END.format(case_id=case_id)}"
+                        for case_id, _ in cases)
+    return f"""
+以下共有 {len(cases)} 位患者的病案JSON数据，请为每位患者分别生成一份独立、完整的报告。
+每份报告只能使用该患者自己的数据，并严格按下列格式输出（标记行原样保留，各占一行）：
+{markers}
+
+——报告要求——
+{prompt_template}
+
+——各患者JSON数据——
+{blocks}
+"""
+
+
+def split_pack_output(output, case_ids):
+    """按标记拆分打包输出并校验；返回 {病案号: 报告}，校验不通过的病案不包含在内"""
+    reports = {}
+    for case_id in case_ids:
+        pattern = re.escape(PACK_BEGIN.format(case_id=case_id)) + r"\s*(.*?)\s*" + re.escape(PACK_END.format(case_id=case_id))
+        matches = re.findall(pattern, output, flags=re.S)
+        if len(matches) != 1:
+            continue
+        text = matches[0].strip()
+        others = [c for c in case_ids if c != case_id]
+        if len(text) < PACK_MIN_REPORT_CHARS or any(c in text for c in others) or "=====REPORT" in text:
+            continue
+        reports[case_id] = text
+    return reports
+
+
+def process_pack(client, filenames, prompt_template, mode, map_workers):
+    """一次请求生成多个小病案的报告；未能正确拆分的病案回退为单病案请求"""
+    cases = [(os.path.splitext(fn)[0], read_case_json(fn)) for fn in filenames]
+    case_ids = [case_id for case_id, _ in cases]
+    print(f"📦 打包处理：{', '.join(case_ids)}")
+    try:
+        output = chat(client, PACK_SYSTEM_PROMPT, build_pack_input(cases, prompt_template), label="打包请求 ")
+        reports = split_pack_output(output, case_ids)
+    except Exception as e:
+        print(f"❌ 打包请求出错：{e}")
+        reports = {}
+
+    for filename, case_id in zip(filenames, case_ids):
+        if case_id in reports:
+            write_report(case_id, reports[case_id])
+        else:
+            print(f"⚠️ [{case_id}] 打包输出解析失败，改为单独请求")
+            process_case(client, filename, prompt_template, mode, map_workers)
+
+
+# ========== 试运行（dry-run）规划 ==========
+PLAN_FILE = "./temp/report_plan.json"
+EST_REPORT_OUTPUT_TOKENS = 3000  # 每次报告类请求的预估输出 token
+EST_MAP_OUTPUT_TOKENS = 800      # 每个 map 分区的预估输出 token
+EST_LATENCY_BASE = 3.0           # 每次请求的固定耗时（秒）
+EST_OUTPUT_TOKENS_PER_S = 40.0   # 模型输出速度（token/秒）
+RPM_LIMIT = int(os.environ.get("RPM_LIMIT", 0))  # 每分钟请求数上限，0 表示不限
+TPM_LIMIT = int(os.environ.get("TPM_LIMIT", 0))  # 每分钟 token 数上限，0 表示不限
+TOP_N_CASES = 10
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None  # None：尚未加载；False：编码表不可用，改用估算
+
+
+def count_tokens(text):
+    """优先用 tiktoken 精确计数；未安装或编码表不可用时按中文 1 字 ≈ 1 token、其他 ≈ 3.5 字符/token 估算"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(MODEL_NAME)
+            except Exception:
+                # 未知模型名，或首次使用时无法下载编码表（离线环境）
+                try:
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"⚠️ tiktoken 编码表不可用，改用估算计数：{e}")
+                    _encoding = False
+        if _encoding:
+            return len(_encoding.encode(text))
+    cjk = len(re.findall(r"[\u3400-\u9fff\uff00-\uffef\u3000-\u303f]", text))
+    return cjk + int((len(text) - cjk) / 3.5)
+
+
+def request_latency(output_tokens):
+    return EST_LATENCY_BASE + output_tokens / EST_OUTPUT_TOKENS_PER_S
+
+
+def plan_case(data_json, prompt_template, mode, map_workers):
+    """
+    按真实运行时的分段与拼接方式构造全部请求并计数。
+    serial 模式下后续分段的前文摘要按 CONTEXT_SNIPPET_LEN 上限计。
+    返回 (请求数, 输入 token, 输出 token, 预估耗时秒)。
+    """
+    system_tokens = count_tokens(SYSTEM_PROMPT)
+    if mode == "mapreduce" and len(data_json) > CHUNK_SIZE:
+        basic_info, map_requests = build_map_requests(data_json)
+        map_system = count_tokens(MAP_SYSTEM_PROMPT)
+        in_tokens = sum(map_system + count_tokens(text) for _, text in map_requests)
+        notes = [(title, "要" * EST_MAP_OUTPUT_TOKENS) for title, _ in map_requests]
+        in_tokens += count_tokens(REDUCE_SYSTEM_PROMPT) + count_tokens(
+            build_reduce_input(basic_info, notes, prompt_template))
+        out_tokens = EST_MAP_OUTPUT_TOKENS * len(map_requests) + EST_REPORT_OUTPUT_TOKENS
+        rounds = -(-len(map_requests) // max(1, map_workers))
+        seconds = rounds * request_latency(EST_MAP_OUTPUT_TOKENS) + request_latency(EST_REPORT_OUTPUT_TOKENS)
+        return len(map_requests) + 1, in_tokens, out_tokens, seconds
+
+    chunks = split_text(data_json, CHUNK_SIZE)
+    in_tokens = 0
+    for idx, chunk in enumerate(chunks, 1):
+        previous_summary = "" if idx == 1 else "前" * CONTEXT_SNIPPET_LEN
+        in_tokens += system_tokens + count_tokens(
+            build_serial_input(idx, len(chunks), previous_summary, chunk, prompt_template))
+    out_tokens = EST_REPORT_OUTPUT_TOKENS * len(chunks)
+    seconds = len(chunks) * request_latency(EST_REPORT_OUTPUT_TOKENS)
+    return len(chunks), in_tokens, out_tokens, seconds
+
+
+def dry_run(filenames, prompt_template, mode, workers, map_workers, rpm=RPM_LIMIT, tpm=TPM_LIMIT,
+            pack_budget=0, plan_file=PLAN_FILE):
+    """不调用接口，统计本批次的请求数、token 数并估算总耗时，结果写入 plan_file 供界面展示"""
+    cases = []
+    packs, singles = plan_packs(filenames, pack_budget, prompt_template)
+    for pack in packs:
+        pack_cases = [(os.path.splitext(fn)[0], read_case_json(fn)) for fn in pack]
+        out_tokens = EST_REPORT_OUTPUT_TOKENS * len(pack)
+        cases.append({
+            "case_id": "+".join(case_id for case_id, _ in pack_cases),
+            "requests": 1,
+            "input_tokens": count_tokens(PACK_SYSTEM_PROMPT) + count_tokens(build_pack_input(pack_cases, prompt_template)),
+            "output_tokens": out_tokens,
+            "seconds": round(request_latency(out_tokens), 1),
+        })
+    for filename in singles:
+        data_json = read_case_json(filename)
+        n_requests, in_tokens, out_tokens, seconds = plan_case(data_json, prompt_template, mode, map_workers)
+        cases.append({
+            "case_id": os.path.splitext(filename)[0],
+            "requests": n_requests,
+            "input_tokens": in_tokens,
+            "output_tokens": out_tokens,
+            "seconds": round(seconds, 1),
+        })
+
+    # 按提交顺序模拟 workers 个并发槽位
+    slots = [0.0] * max(1, workers)
+    for case in cases:
+        i = slots.index(min(slots))
+        slots[i] += case["seconds"]
+    makespan = max(slots) if cases else 0.0
+
+    total_requests = sum(c["requests"] for c in cases)
+    total_input = sum(c["input_tokens"] for c in cases)
+    total_output = sum(c["output_tokens"] for c in cases)
+    # 速率限制下的耗时下限
+    rate_bound = 0.0
+    if rpm:
+        rate_bound = max(rate_bound, total_requests / rpm * 60)
+    if tpm:
+        rate_bound = max(rate_bound, (total_input + total_output) / tpm * 60)
+
+    plan = {
+        "mode": mode,
+        "packs": len(packs),
+        "workers": workers,
+        "map_workers": map_workers,
+        "pack_budget": pack_budget,
+        "rpm": rpm,
+        "tpm": tpm,
+        # 界面据此判断规划是否对应当前的 Prompt 与参数，不一致时不再展示
+        "prompt_sha256": hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(),
+        "tokenizer": "tiktoken" if tiktoken is not None and _encoding is not False else "estimate",
+        "cases": len(filenames),
+        "requests": total_requests,
+        "input_tokens": total_input,
+        "output_tokens": total_output,
+        "estimated_seconds": round(max(makespan, rate_bound), 1),
+        "rate_limited": rate_bound > makespan,
+        "largest_cases": sorted(cases, key=lambda c: c["input_tokens"], reverse=True)[:TOP_N_CASES],
+    }
+
+    os.makedirs(os.path.dirname(plan_file), exist_ok=True)
+    with open(plan_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+
+    print(f"📊 试运行（{mode}，并发 {workers}，计数方式：{plan['tokenizer']}）")
+    print(f"  病案数：{plan['cases']}，请求数：{total_requests}")
+    print(f"  输入 token：{total_input:,}，预估输出 token：{total_output:,}")
+    print(f"  预估耗时：{plan['estimated_seconds'] / 3600:.2f} 小时"
+          + ("（受速率限制）" if plan["rate_limited"] else ""))
+    for c in plan["largest_cases"]:
+        print(f"  · {c['case_id']}：{c['requests']} 次请求，{c['input_tokens']:,} 输入 token")
+    print(f"✅ 规划结果已写入：{plan_file}")
+    return plan
+
+
+def write_report(base_name, text):
+    output_filename = base_name + ".txt"
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    with open(output_path, "w", encoding="utf-8") as out_f:
+        out_f.write(text.strip())
+
+    print(f"✅ 报告生成完成：{output_filename}")
+
+
+def process_case(client, filename, prompt_template, mode, map_workers):
+    base_name = os.path.splitext(filename)[0]
+    data_json = read_case_json(filename)
+    progress = ReportProgress(base_name, progress_fingerprint(mode, data_json, prompt_template))
+
+    print(f"📄 正在处理：{filename}" + (f"（从检查点继续，已完成 {len(progress.outputs)} 段）" if progress.outputs else ""))
+
+    if mode == "mapreduce":
+        try:
+            full_output = generate_report_mapreduce(client, data_json, prompt_template, map_workers, progress)
+        except Exception as e:
+            print(f"❌ {filename} 生成失败：{e}")
+            return
+    else:
+        full_output = generate_report_serial(client, data_json, prompt_template, progress)
+
+    if full_output is None:
+        if os.path.exists(progress.part_path):
+            print(f"⚠️ {filename} 未完成，已保存进度，部分报告见 {os.path.basename(progress.part_path)}")
+        else:
+            print(f"⚠️ {filename} 未完成，已保存进度，重新运行将从中断处继续")
+        return
+    write_report(base_name, full_output)
+    progress.finish()
+
+
+def set_workspace(root):
+    """将输入输出路径切换到指定工作区根目录下"""
+    global INPUT_JSON_DIR, PDF_DIR, PROMPT_FILE, OUTPUT_DIR, PLAN_FILE, METRICS_FILE
+    INPUT_JSON_DIR = os.path.join(root, "data_03_json")
+    PDF_DIR = os.path.join(root, "data_02_pdf")
+    PROMPT_FILE = os.path.join(root, "conf", "prompt.txt")
+    OUTPUT_DIR = os.path.join(root, "data_04_summary_txt")
+    PLAN_FILE = os.path.join(root, "temp", "report_plan.json")
+    METRICS_FILE = os.path.join(root, "temp", "llm_requests.jsonl")
+
+
+def main(case_ids=None, mode="serial", workers=1, map_workers=MAP_WORKERS, dry_run_only=False,
+         rpm=RPM_LIMIT, tpm=TPM_LIMIT, pack_budget=0):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    with open(PROMPT_FILE, "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+
+    filenames = []
+    for filename in os.listdir(INPUT_JSON_DIR):
+        if not filename.endswith(".json"):
+            continue
+
+        # ===== 新增逻辑：检查对应 PDF 是否存在 =====
+        base_name = os.path.splitext(filename)[0]
+        if case_ids is not None and base_name not in case_ids:
+            continue
+        pdf_path = os.path.join(PDF_DIR, base_name + ".pdf")
+        if not os.path.exists(pdf_path):
+            print(f"⚠️ 跳过：{filename} —— 未找到对应 PDF：{base_name}.pdf")
+            continue
+        # ========================================
+        filenames.append(filename)
 
-        output_filename = base_name + ".txt"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        with open(output_path, "w", encoding="utf-8") as out_f:
-            out_f.write(full_output.strip())
+    if dry_run_only:
+        dry_run(filenames, prompt_template, mode, workers, map_workers, rpm, tpm, pack_budget, PLAN_FILE)
+        return
 
-        print(f"✅ 报告生成完成：{output_filename}")
+    client = make_client()
+    packs, singles = plan_packs(filenames, pack_budget, prompt_template)
+    print(f"🚀 生成模式：{mode}，并发病案数：{workers}，共 {len(filenames)} 个病案"
+          + (f"，其中 {sum(len(p) for p in packs)} 个小病案打包为 {len(packs)} 个请求" if packs else ""))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(process_pack, client, pack, prompt_template, mode, map_workers) for pack in packs]
+        futures += [pool.submit(process_case, client, fn, prompt_template, mode, map_workers) for fn in singles]
+        for future in futures:
+            future.result()
 
     print("\n🎯 所有文件处理完成。")
 
 if __name__ == "__main__":
-    main()
+    parser = build_arg_parser("调用大模型生成病案总结报告")
+    parser.add_argument("--mode", choices=GENERATION_MODES, default=os.environ.get("REPORT_MODE", "serial"),
+                        help="serial：逐段串行续写；mapreduce：分区并发提取要点后一次汇总")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("REPORT_WORKERS", 1)),
+                        help="同时处理的病案数")
+    parser.add_argument("--map-workers", type=int, default=MAP_WORKERS,
+                        help="mapreduce 模式下单个病案内并发的请求数")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="只统计请求数、token 数并估算耗时，不调用接口")
+    parser.add_argument("--rpm", type=int, default=RPM_LIMIT, help="每分钟请求数上限（仅用于估算）")
+    parser.add_argument("--tpm", type=int, default=TPM_LIMIT, help="每分钟 token 数上限（仅用于估算）")
+    parser.add_argument("--pack-budget", type=int, default=int(os.environ.get("PACK_BUDGET", 0)),
+                        help="将多个小病案打包到一次请求的输入 token 预算（含提示词与打包标记），0 表示不打包")
+    args = parser.parse_args()
+    set_workspace(args.workspace)
+    main(load_case_ids(args.cases), args.mode, args.workers, args.map_workers, args.dry_run,
+         args.rpm, args.tpm, args.pack_budget)
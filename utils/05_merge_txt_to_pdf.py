@@ -4,6 +4,7 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from PyPDF2 import PdfMerger
 import os
+from common import build_arg_parser, load_case_ids
 
 def txt_to_pdf(txt_path, pdf_path):
     """将 TXT 文件转换为支持中文和自动换行的 PDF"""
@@ -49,11 +50,27 @@ def merge_pdfs(pdf_list, output_path):
     merger.close()
 
 
-def main():
-    # ======== 配置区域 ========
-    pdf_dir = "./data_02_pdf"
-    txt_dir = "./data_04_summary_txt"
-    output_dir = "./data_05_final_pdf"
+def merge_case(key, original_pdf, txt_file, output_dir):
+    """将单个病案的报告 TXT 转为 PDF 并追加到原始 PDF 之后"""
+    temp_pdf = os.path.join(output_dir, f"{key}_temp.pdf")
+    output_pdf = os.path.join(output_dir, f"{key}_merge.pdf")
+
+    print(f"📄 [{key}] 正在将 TXT 转换为 PDF...")
+    txt_to_pdf(txt_file, temp_pdf)
+
+    print(f"🔗 [{key}] 正在合并 PDF 文件...")
+    merge_pdfs([original_pdf, temp_pdf], output_pdf)
+
+    os.remove(temp_pdf)
+    print(f"✅ [{key}] 合并完成 -> {output_pdf}")
+    return output_pdf
+
+
+def main(case_ids=None, workspace="."):
+    # ======== 配置区域（相对于工作区根目录） ========
+    pdf_dir = os.path.join(workspace, "data_02_pdf")
+    txt_dir = os.path.join(workspace, "data_04_summary_txt")
+    output_dir = os.path.join(workspace, "data_05_final_pdf")
     os.makedirs(output_dir, exist_ok=True)
     # ==========================
 
@@ -63,28 +80,19 @@ def main():
                  for f in os.listdir(txt_dir) if f.lower().endswith(".txt")}
 
     common_keys = sorted(set(pdf_files.keys()) & set(txt_files.keys()))
+    if case_ids is not None:
+        common_keys = [k for k in common_keys if k in case_ids]
 
     if not common_keys:
         print("⚠️ 没有找到匹配的 PDF 和 TXT 文件。")
         return
 
     for key in common_keys:
-        original_pdf = pdf_files[key]
-        txt_file = txt_files[key]
-        temp_pdf = os.path.join(output_dir, f"{key}_temp.pdf")
-        output_pdf = os.path.join(output_dir, f"{key}_merge.pdf")
-
-        print(f"📄 [{key}] 正在将 TXT 转换为 PDF...")
-        txt_to_pdf(txt_file, temp_pdf)
-
-        print(f"🔗 [{key}] 正在合并 PDF 文件...")
-        merge_pdfs([original_pdf, temp_pdf], output_pdf)
-
-        os.remove(temp_pdf)
-        print(f"✅ [{key}] 合并完成 -> {output_pdf}")
+        merge_case(key, pdf_files[key], txt_files[key], output_dir)
 
     print("🎉 所有文件处理完成！")
 
 
 if __name__ == "__main__":
-    main()
+    args = build_arg_parser("将报告 TXT 转为 PDF 并与原始 PDF 合并").parse_args()
+    main(load_case_ids(args.cases), args.workspace)
@@ -0,0 +1,253 @@
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import blob_store
+from common import build_arg_parser, load_case_ids, parse_shard, shard_of
+from csv_reader import CSV_ENGINES, DEFAULT_CSV_ENGINE, index_case_ids, load_row_index, read_tables
+from pipeline import start_stage
+
+# ========== 无界面批处理 ==========
+# 不经过 Streamlit 页面，按保存好的字段选择与 Prompt 依次执行全部阶段，适合定时任务。
+# 多台机器共享同一文件系统时：
+#   1. 任一节点执行一次 --prepare：01 格式转换、00 字段选择、02 PDF 重命名只对整批做一次；
+#   2. 各节点以 --shard i/N 按病案号哈希处理互不重叠的一部分（03 → 05），
+#      分片工作区 <工作区>/shards/shard_i_of_N/ 通过符号链接共用准备好的 CSV 与 PDF；
+#   3. 全部节点完成后执行 --merge，把各分片的报告与最终 PDF 汇总到 <工作区> 下。
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HEADERS_FILE = os.path.join(BASE_DIR, "conf", "headers_default.json")
+DEFAULT_PROMPT_FILE = os.path.join(BASE_DIR, "conf", "prompt_default.txt")
+TABLE_NAMES = ["检查信息", "病案首页", "检验信息", "医嘱信息"]
+DONE_FILE = os.path.join("temp", "batch_done.json")
+PREPARED_FILE = os.path.join("temp", "batch_prepared.json")
+SHARD_DIR_PATTERN = re.compile(r"^shard_(\d+)_of_(\d+)$")
+SHARED_DIRS = ["data_01_csv", "data_02_pdf"]    # 分片只读共用的准备结果
+SHARED_CONF = ["headers.json", "prompt.txt"]
+MERGE_DIRS = ["data_04_summary_txt", "data_05_final_pdf"]
+
+
+def shard_workspace(workspace, shard):
+    """为分片建立独立工作区，准备阶段的 CSV、PDF 以符号链接共用，配置文件复制一份"""
+    prepared_file = os.path.join(workspace, PREPARED_FILE)
+    prepared = {}
+    if os.path.exists(prepared_file):
+        with open(prepared_file, "r", encoding="utf-8") as f:
+            prepared = json.load(f)
+    if not prepared.get("renamed"):
+        raise RuntimeError(f"❌ {workspace} 尚未准备（或未重命名 PDF），请先执行一次 --prepare")
+    root = os.path.join(workspace, "shards", f"shard_{shard[0]}_of_{shard[1]}")
+    os.makedirs(os.path.join(root, "conf"), exist_ok=True)
+    for name in SHARED_DIRS:
+        link = os.path.join(root, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(os.path.join(workspace, name)), link)
+    for name in SHARED_CONF:
+        shutil.copyfile(os.path.join(workspace, "conf", name), os.path.join(root, "conf", name))
+    return root
+
+
+def run_stage(script_name, args):
+    """执行一个阶段脚本并等待结束，日志带阶段前缀转发"""
+    start = time.time()
+    process = start_stage(script_name, args)
+    process.wait()
+    process.log_thread.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"❌ 阶段执行失败：{script_name}（返回码 {process.returncode}）")
+    print(f"⏱️ {script_name} 完成，用时 {time.time() - start:.0f} 秒", flush=True)
+
+
+def apply_saved_headers(headers_file, saved_file):
+    """
+    按保存的字段选择过滤 00 阶段读出的表头，规则与页面一致：
+    保留已保存且实际存在的字段，某表没有可用的保存字段时保留全部字段。
+    """
+    with open(headers_file, "r", encoding="utf-8") as f:
+        available = json.load(f)
+    saved = {}
+    if saved_file and os.path.exists(saved_file):
+        with open(saved_file, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    selected = {}
+    for table_name, fields in available.items():
+        selected[table_name] = [f for f in (saved.get(table_name) or []) if f in fields] or fields
+        missing = [f for f in (saved.get(table_name) or []) if f not in fields]
+        print(f"🧩 {table_name}：保留 {len(selected[table_name])}/{len(fields)} 个字段", flush=True)
+        if missing:
+            print(f"⚠️ {table_name} 中不存在以下已保存字段：{', '.join(missing)}", flush=True)
+    with open(headers_file, "w", encoding="utf-8") as f:
+        json.dump(selected, f, ensure_ascii=False, indent=2)
+
+
+def read_workspace_case_ids(workspace, csv_engine):
+    """工作区各表中出现的全部病案号：有行索引的表直接取索引，否则只读取病案号列"""
+    csv_dir = os.path.join(workspace, "data_01_csv")
+    tables = {name: os.path.join(csv_dir, f"{name}.csv") for name in TABLE_NAMES}
+    tables = {name: path for name, path in tables.items() if os.path.exists(path)}
+    case_ids = set()
+    for name, path in list(tables.items()):
+        index = load_row_index(path)
+        if index is not None:
+            case_ids |= index_case_ids(index)
+            del tables[name]
+    if tables:
+        dfs = read_tables(tables, usecols={name: {"病案号"} for name in tables}, engine=csv_engine)
+        case_ids = case_ids.union(*(set(df["病案号"]) for df in dfs.values()))
+    return case_ids
+
+
+def count_files(directory, suffix):
+    if not os.path.isdir(directory):
+        return 0
+    return sum(1 for f in os.listdir(directory) if f.endswith(suffix))
+
+
+def prepare(args, workspace, rename=True):
+    """01 → 00（按保存的字段选择）→ 02：整批只做一次，分片运行时共用结果"""
+    prepared_file = os.path.join(workspace, PREPARED_FILE)
+    if os.path.exists(prepared_file):
+        os.remove(prepared_file)
+    os.makedirs(os.path.join(workspace, "temp"), exist_ok=True)
+    stage_args = ["--workspace", workspace]
+    # 各分片只读取自己的病案：建立行索引，避免每个分片都解析整张表
+    run_stage("01_parse_xls_to_csv.py", stage_args + ["--row-index"])
+    run_stage("00_read_headers.py", stage_args)
+    apply_saved_headers(os.path.join(workspace, "conf", "headers.json"), args.headers)
+    shutil.copyfile(args.prompt, os.path.join(workspace, "conf", "prompt.txt"))
+    if rename:
+        run_stage("02_rename_pdf.py", stage_args + (["--cases", args.cases] if args.cases else []))
+    with open(prepared_file, "w", encoding="utf-8") as f:
+        json.dump({"renamed": rename, "time": round(time.time())}, f, ensure_ascii=False, indent=2)
+
+
+def run(args):
+    shard = parse_shard(args.shard) if args.shard else None
+    start_time = time.time()
+    if shard:
+        workspace = shard_workspace(args.workspace, shard)
+    else:
+        workspace = args.workspace
+        # 单机流水线模式由 pipeline.py 同时执行 02 与 03，此处不单独重命名
+        prepare(args, workspace, rename=not args.pipeline)
+    done_file = os.path.join(workspace, DONE_FILE)
+    if os.path.exists(done_file):
+        os.remove(done_file)
+    os.makedirs(os.path.join(workspace, "temp"), exist_ok=True)
+    stage_args = ["--workspace", workspace]
+
+    # ========== 病案子集：--cases 与分片取交集 ==========
+    case_ids = load_case_ids(args.cases)
+    if shard:
+        universe = case_ids if case_ids is not None else read_workspace_case_ids(workspace, args.csv_engine)
+        case_ids = {c for c in universe if shard_of(c, shard[1]) == shard[0]}
+        print(f"🧮 分片 {shard[0]}/{shard[1]}：{len(case_ids)}/{len(universe)} 个病案", flush=True)
+
+    if case_ids is not None and not case_ids:
+        print("⚠️ 本分片没有需要处理的病案。", flush=True)
+    else:
+        if case_ids is not None:
+            cases_file = os.path.join(workspace, "temp", "case_ids.txt")
+            with open(cases_file, "w", encoding="utf-8") as f:
+                f.write("\n".join(sorted(case_ids)))
+            stage_args = stage_args + ["--cases", cases_file]
+
+        # ========== 03 → 05（PDF 已在准备阶段重命名；单机流水线模式由 pipeline.py 同时执行 02） ==========
+        report_args = ["--mode", args.mode, "--workers", str(args.jobs)]
+        if args.pipeline:
+            run_stage("pipeline.py", stage_args + report_args + ["--csv-engine", args.csv_engine]
+                      + (["--skip-rename"] if shard else [])
+                      + (["--compact"] if args.compact else []) + (["--abnormal-only"] if args.abnormal_only else []))
+        else:
+            run_stage("03_merge_csv_to_json.py", stage_args + ["--csv-engine", args.csv_engine])
+            if args.compact:
+                run_stage("03b_compact_lab_results.py", stage_args + (["--abnormal-only"] if args.abnormal_only else []))
+            run_stage("04_generate_reports_infini.py", stage_args + report_args)
+            run_stage("05_merge_txt_to_pdf.py", stage_args)
+
+    summary = {
+        "shard": args.shard,
+        "cases": len(case_ids) if case_ids is not None else count_files(os.path.join(workspace, "data_03_json"), ".json"),
+        "reports": count_files(os.path.join(workspace, "data_04_summary_txt"), ".txt"),
+        "final_pdfs": count_files(os.path.join(workspace, "data_05_final_pdf"), ".pdf"),
+        "seconds": round(time.time() - start_time),
+    }
+    with open(done_file, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"\n🎯 批处理完成：病案 {summary['cases']} 个，报告 {summary['reports']} 份，"
+          f"最终 PDF {summary['final_pdfs']} 份，总用时 {summary['seconds']} 秒")
+
+
+def merge(args):
+    """汇总各分片的报告与最终 PDF 到工作区根目录（硬链接，不复制）"""
+    shards_dir = os.path.join(args.workspace, "shards")
+    found = {}
+    for name in sorted(os.listdir(shards_dir)) if os.path.isdir(shards_dir) else []:
+        match = SHARD_DIR_PATTERN.match(name)
+        if match:
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = os.path.join(shards_dir, name)
+    if len(found) != 1:
+        print(f"❌ 需要且只能有一种分片数，实际找到：{sorted(found) or '无'}")
+        sys.exit(1)
+    count, shards = next(iter(found.items()))
+
+    manifest = {"shards": count, "complete": [], "missing": [], "reports": 0, "final_pdfs": 0}
+    for key in MERGE_DIRS:
+        os.makedirs(os.path.join(args.workspace, key), exist_ok=True)
+    for i in range(1, count + 1):
+        root = shards.get(i)
+        if root is None or not os.path.exists(os.path.join(root, DONE_FILE)):
+            manifest["missing"].append(i)
+            print(f"⚠️ 分片 {i}/{count} 尚未完成，跳过")
+            continue
+        manifest["complete"].append(i)
+        for key in MERGE_DIRS:
+            src_dir = os.path.join(root, key)
+            for f in sorted(os.listdir(src_dir)) if os.path.isdir(src_dir) else []:
+                # 跳过生成中的部分报告与续跑检查点
+                if f.endswith(".part") or f.startswith("."):
+                    continue
+                blob_store.link(os.path.join(src_dir, f), os.path.join(args.workspace, key, f))
+                manifest["reports" if key == "data_04_summary_txt" else "final_pdfs"] += 1
+        print(f"✅ 已汇总分片 {i}/{count}")
+
+    os.makedirs(os.path.join(args.workspace, "temp"), exist_ok=True)
+    with open(os.path.join(args.workspace, "temp", "batch_manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"\n🎉 汇总完成：报告 {manifest['reports']} 份，最终 PDF {manifest['final_pdfs']} 份")
+    if manifest["missing"]:
+        print(f"❌ 未完成的分片：{', '.join(map(str, manifest['missing']))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser("无界面批处理：按保存的字段与 Prompt 依次执行全部阶段，支持多节点分片")
+    parser.add_argument("--headers", default=DEFAULT_HEADERS_FILE,
+                        help="保存的字段选择（格式同 conf/headers.json），默认使用推荐字段配置")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT_FILE, help="报告生成使用的 Prompt 文件")
+    parser.add_argument("--jobs", type=int, default=int(os.environ.get("REPORT_WORKERS", 1)),
+                        help="本机同时生成报告的病案数")
+    parser.add_argument("--shard", default=os.environ.get("BATCH_SHARD"),
+                        help="i/N：只处理按病案号哈希落在第 i 片（共 N 片，i 从 1 开始）的病案")
+    parser.add_argument("--prepare", action="store_true",
+                        help="仅执行 01 → 00 → 02 准备整批数据（分片运行前在任一节点执行一次）")
+    parser.add_argument("--merge", action="store_true", help="仅汇总各分片的输出（全部节点完成后执行）")
+    parser.add_argument("--pipeline", action="store_true", help="以按病案流水线方式执行 03 → 05")
+    parser.add_argument("--mode", choices=("serial", "mapreduce"), default=os.environ.get("REPORT_MODE", "serial"),
+                        help="报告生成模式，同 04 阶段")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default=DEFAULT_CSV_ENGINE,
+                        help="CSV 读取引擎")
+    parser.add_argument("--compact", action="store_true", help="报告生成前压缩检验结果（03b 阶段）")
+    parser.add_argument("--abnormal-only", action="store_true", help="压缩时检验结果仅保留异常值及首末、极值点")
+    args = parser.parse_args()
+    try:
+        if args.merge:
+            merge(args)
+        elif args.prepare:
+            prepare(args, args.workspace)
+        else:
+            run(args)
+    except (RuntimeError, ValueError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# ========== 内容寻址文件库 ==========
+# 每份内容按 sha256 只在 <工作区>/.blobs/ab/abcdef... 中保存一次，
+# 各阶段目录中的文件只是指向它的硬链接，不再逐字节复制。
+# 硬链接数即引用计数：阶段目录删除文件只是减少引用，gc() 回收引用数为 1（仅库内自身）的内容。
+# 由文件库自身写出的内容（上传入库、跨文件系统复制）设为只读，防止通过某个阶段目录原地改写而影响其他引用；
+# 从用户原有文件硬链接入库时不改动其权限。
+BLOB_DIR_NAME = ".blobs"
+UPLOAD_INDEX_NAME = ".upload_index.json"  # 上传入库时记录的 内容哈希 -> 文件名
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+TMP_PREFIX = ".tmp-"
+TMP_MAX_AGE = 3600  # 中断遗留的临时文件超过该时长（秒）才回收
+
+
+def store_dir(workspace):
+    """文件库目录：可通过环境变量 BLOB_STORE_DIR 指定（需与工作区在同一文件系统才能硬链接）"""
+    return os.environ.get("BLOB_STORE_DIR") or os.path.join(workspace, BLOB_DIR_NAME)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_CHUNK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_path(store, digest):
+    return os.path.join(store, digest[:2], digest)
+
+
+def load_digest_hints(directory):
+    """读取上传索引，返回 {文件名: 内容哈希}，用于跳过已入库文件的重复哈希"""
+    try:
+        with open(os.path.join(directory, UPLOAD_INDEX_NAME), "r", encoding="utf-8") as f:
+            return {name: digest for digest, name in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def put(store, path, digest=None, move=False, hint=None):
+    """
+    将文件存入库中并返回库内路径。内容已存在时直接复用；
+    move=True 时把 path 本身移入库中（用于上传时自己写出的临时文件）。
+    hint 为索引中记录的哈希：仅当 path 与该库内文件是同一 inode 时采信，免去整文件重读。
+    """
+    if hint and not move:
+        target = blob_path(store, hint)
+        if os.path.exists(target) and os.path.samefile(target, path):
+            return target
+    digest = digest or file_digest(path)
+    target = blob_path(store, digest)
+    if os.path.exists(target):
+        if move:
+            os.remove(path)
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(target), f"{TMP_PREFIX}{uuid.uuid4().hex}")
+    owned = move
+    if move:
+        os.replace(path, tmp_path)
+    else:
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            # 跨文件系统等无法硬链接时退回复制（仅此一次，之后的引用都是硬链接）
+            shutil.copyfile(path, tmp_path)
+            owned = True
+    if owned:
+        os.chmod(tmp_path, 0o444)
+    try:
+        # 不用 os.replace：并发写入同一内容时保留先到的那份，已有的链接不会失效
+        os.link(tmp_path, target)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    return target
+
+
+def link(blob, dest):
+    """在阶段目录中创建指向库内内容的硬链接，先建临时链接再改名，读者不会看到不完整的文件"""
+    # 重跑时 dest 往往已是同一内容的链接：rename 到同一 inode 的另一链接在 POSIX 上什么也不做，会留下 .part
+    if os.path.exists(dest) and os.path.samefile(blob, dest):
+        return dest
+    tmp_path = f"{dest}.part"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(blob, tmp_path)
+    except OSError:
+        shutil.copyfile(blob, tmp_path)
+    os.replace(tmp_path, dest)
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    return dest
+
+
+def stage(store, src, dest, hint=None):
+    """把 src 的内容放入 dest：存入库中后以硬链接的形式出现在阶段目录"""
+    return link(put(store, src, hint=hint), dest)
+
+
+def gc(store):
+    """回收不再被任何阶段目录引用的内容，返回 (回收文件数, 释放字节数)"""
+    removed, freed = 0, 0
+    if not os.path.isdir(store):
+        return removed, freed
+    now = time.time()
+    for root, _, files in os.walk(store):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.startswith(TMP_PREFIX):
+                if now - st.st_mtime < TMP_MAX_AGE:
+                    continue
+            elif st.st_nlink > 1:
+                continue
+            os.remove(path)
+            removed += 1
+            freed += st.st_size
+    for name in os.listdir(store):
+        subdir = os.path.join(store, name)
+        if os.path.isdir(subdir) and not os.listdir(subdir):
+            os.rmdir(subdir)
+    return removed, freed
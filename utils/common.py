@@ -0,0 +1,75 @@
+import argparse
+import hashlib
+import os
+import re
+
+# ========== 各阶段脚本共用的参数与工具 ==========
+CASE_ID_WIDTH = 6
+
+
+def normalize_case_id(value):
+    """将单个病案号统一为6位数字（前补0）"""
+    return str(value).strip().zfill(CASE_ID_WIDTH)
+
+
+def load_case_ids(spec):
+    """
+    解析病案号子集：既可以是逗号/空格/换行分隔的病案号列表，
+    也可以是每行一个病案号的文本文件路径。
+    未指定时返回 None（表示处理全部病案）。
+    """
+    if not spec:
+        return None
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8-sig") as f:
+            text = f.read()
+    else:
+        text = spec
+    case_ids = {normalize_case_id(t) for t in re.split(r"[\s,，;；]+", text) if t.strip()}
+    if not case_ids:
+        raise ValueError(f"❌ 未解析到任何病案号：{spec}")
+    return case_ids
+
+
+def parse_shard(spec):
+    """解析 "i/N" 形式的分片参数（i 从 1 开始），返回 (i, N)"""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"❌ 分片参数应为 i/N 且 1 ≤ i ≤ N：{spec}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(case_id, count):
+    """按病案号的稳定哈希（与进程、机器无关）分配分片，返回 1..count"""
+    digest = hashlib.sha256(normalize_case_id(case_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+TIME_PATTERN = re.compile(r"(\d{4})\D?(\d{1,2})\D?(\d{1,2})(?:\D+(\d{1,2})[:时](\d{1,2})(?:[:分](\d{1,2}))?)?")
+
+
+def time_key(value):
+    """
+    将各种写法的时间（2024-1-5 8:00、2024/01/05 08:00:00、20240105 等）统一为可比较的元组；
+    无法识别的排在最后并按原文排序。
+    """
+    match = TIME_PATTERN.search(str(value))
+    if not match:
+        return (1, (), str(value))
+    return (0, tuple(int(g or 0) for g in match.groups()), str(value))
+
+
+def build_arg_parser(description):
+    """构建各阶段通用的命令行参数"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--cases",
+        default=os.environ.get("CASE_IDS"),
+        help="仅处理指定病案号：逗号分隔的列表或每行一个病案号的文件路径（默认处理全部）",
+    )
+    parser.add_argument(
+        "--workspace",
+        default=os.environ.get("WORKSPACE", "."),
+        help="工作区根目录（包含各 data_* 目录与 conf/），默认当前目录",
+    )
+    return parser
@@ -0,0 +1,336 @@
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from common import CASE_ID_WIDTH
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# ========== 读取配置 ==========
+PANDAS_ENCODINGS = ["utf-8-sig", "gbk", "gb2312", "utf-8"]
+ARROW_ENCODINGS = ["utf8", "gb18030"]  # 表头非 UTF-8 时直接用 gb18030（兼容 gbk / gb2312）
+ARROW_BLOCK_SIZE = 64 * 1024 * 1024   # pyarrow 每个解析块的字节数
+PANDAS_CHUNK_ROWS = 200000            # pandas 分块读取的行数
+CSV_ENGINES = ("auto", "pyarrow", "pandas")
+# 默认仍用 pandas：pyarrow 的加速尚未在多 GB 数据、多核机器上实测（bench/bench_csv_ingest.py），
+# 实测确认后再改为 auto；也可通过环境变量 CSV_ENGINE 或 --csv-engine 选择
+DEFAULT_CSV_ENGINE = os.environ.get("CSV_ENGINE", "pandas")
+ROW_INDEX_SUFFIX = ".rows.npz"        # 病案号 -> 行所在字节区间的索引，与 CSV 同目录的隐藏文件
+
+
+def normalize_case_id(series):
+    """将病案号统一为6位数字（前补0）"""
+    return series.astype(str).str.strip().str.zfill(CASE_ID_WIDTH)
+
+
+def read_csv_headers(path, with_encoding=False):
+    """只读取表头，自动识别编码；with_encoding 时同时返回识别出的编码"""
+    for enc in PANDAS_ENCODINGS:
+        try:
+            df = pd.read_csv(path, encoding=enc, nrows=0)
+            return (list(df.columns), enc) if with_encoding else list(df.columns)
+        except Exception:
+            continue
+    raise ValueError(f"❌ 无法读取文件表头：{path}")
+
+
+# ========== 病案号行索引：子集读取只读取命中病案所在的字节区间 ==========
+def row_index_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}{ROW_INDEX_SUFFIX}")
+
+
+def _iter_records(f):
+    """按物理行读取并拼接为完整记录（引号内换行不切分），返回 (起始偏移, 结束偏移, 记录字节)"""
+    offset = f.tell()
+    record, start, quotes = b"", offset, 0
+    for line in f:
+        if not record:
+            start = offset
+        offset += len(line)
+        record += line
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield start, offset, record
+            record, quotes = b"", 0
+    if record:
+        yield start, offset, record
+
+
+def _scan_rows(path, column, codec):
+    """逐条记录扫描（支持引号内换行），返回 (表头结束偏移, 病案号列表, 起始偏移列表, 结束偏移列表)"""
+    cases, starts, ends = [], [], []
+    with open(path, "rb") as f:
+        records = _iter_records(f)
+        _, header_end, _ = next(records)
+        for start, end, record in records:
+            if not record.strip():
+                continue
+            if b'"' in record:
+                fields = next(csv.reader(io.StringIO(record.decode(codec, errors="replace"))), [])
+                raw = fields[column] if column < len(fields) else ""
+            else:
+                parts = record.split(b",", column + 1)
+                raw = parts[column].decode(codec, errors="replace") if column < len(parts) else ""
+            cases.append(raw.strip().zfill(CASE_ID_WIDTH))
+            starts.append(start)
+            ends.append(end)
+    return header_end, cases, starts, ends
+
+
+def _scan_rows_fast(path, encoding):
+    """
+    不含引号的文件：用 numpy 按块定位换行符得到每行的字节区间，用 pyarrow 多线程读出病案号列，两者按行对应。
+    文件含引号（可能有跨行字段）或行数对不上时返回 None，由 _scan_rows 逐条扫描。
+    """
+    if pa is None:
+        return None
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    newlines = []
+    for offset in range(0, len(data), ARROW_BLOCK_SIZE):
+        block = np.asarray(data[offset:offset + ARROW_BLOCK_SIZE])
+        if (block == ord('"')).any():
+            return None
+        newlines.append(np.flatnonzero(block == ord("\n")) + offset)
+    line_ends = np.concatenate(newlines) + 1 if newlines else np.array([], dtype=np.int64)
+    if len(data) and (not len(line_ends) or line_ends[-1] != len(data)):
+        line_ends = np.append(line_ends, len(data))
+    line_starts = np.concatenate([[0], line_ends[:-1]])
+
+    table = pa_csv.read_csv(
+        path,
+        read_options=pa_csv.ReadOptions(encoding=encoding, use_threads=True, block_size=ARROW_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(include_columns=["病案号"], column_types={"病案号": pa.string()}),
+    )
+    if table.num_rows != len(line_starts) - 1:
+        # 含空行等情况
+        return None
+    cases = _arrow_case_id(table["病案号"]).to_numpy().astype(str)
+    return int(line_ends[0]), cases, line_starts[1:], line_ends[1:]
+
+
+def build_row_index(path):
+    """
+    扫描一遍 CSV，记录每个病案号的行所在字节区间（同一病案相邻的行合并为一个区间），写入隐藏索引文件。
+    GBK / UTF-8 的多字节字符不含引号、逗号、换行的字节值，可以直接按字节切分。
+    """
+    headers, encoding = read_csv_headers(path, with_encoding=True)
+    column = headers.index("病案号")
+    codec = "utf-8" if encoding.startswith("utf") else "gb18030"
+    stat = os.stat(path)
+    scanned = None
+    try:
+        scanned = _scan_rows_fast(path, "utf8" if encoding.startswith("utf") else "gb18030")
+    except (ValueError, OSError, UnicodeDecodeError):  # pyarrow 解析错误均为 ValueError / OSError 的子类
+        pass
+    header_end, cases, starts, ends = scanned or _scan_rows(path, column, codec)
+    cases = np.asarray(cases, dtype=str)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    # 按 (病案号, 起始偏移) 排序后合并首尾相接的区间
+    order = np.lexsort((starts, cases))
+    cases, starts, ends = cases[order], starts[order], ends[order]
+    if len(cases):
+        new_run = np.ones(len(cases), dtype=bool)
+        new_run[1:] = (cases[1:] != cases[:-1]) | (starts[1:] != ends[:-1])
+        run_id = np.cumsum(new_run) - 1
+        merged_ends = np.zeros(run_id[-1] + 1, dtype=np.int64)
+        np.maximum.at(merged_ends, run_id, ends)
+        cases, starts, ends = cases[new_run], starts[new_run], merged_ends
+    meta = json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                       "encoding": encoding, "header_end": header_end})
+    tmp_path = row_index_path(path) + ".part"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=np.array(meta), cases=cases, starts=starts, ends=ends)
+    os.replace(tmp_path, row_index_path(path))
+    return load_row_index(path)
+
+
+def load_row_index(path):
+    """读取行索引；CSV 在建索引后被改动（大小或修改时间不同）时视为无效，返回 None"""
+    try:
+        with np.load(row_index_path(path), allow_pickle=False) as npz:
+            index = json.loads(str(npz["meta"]))
+            index.update(cases=npz["cases"], starts=npz["starts"], ends=npz["ends"])
+        stat = os.stat(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if index["size"] != stat.st_size or index["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    return index
+
+
+def index_case_ids(index):
+    """行索引中出现的全部病案号"""
+    return set(np.unique(index["cases"]).tolist())
+
+
+def read_csv_indexed(path, index, usecols=None, case_ids=None):
+    """按行索引只读取表头与指定病案所在的字节区间，再交给 pandas 解析（子集通常很小）"""
+    mask = np.isin(index["cases"], np.array(sorted(case_ids), dtype=str))
+    starts, ends = index["starts"][mask], index["ends"][mask]
+    order = np.argsort(starts, kind="stable")
+    with open(path, "rb") as f:
+        parts = [f.read(index["header_end"])]
+        for start, end in zip(starts[order].tolist(), ends[order].tolist()):
+            f.seek(start)
+            parts.append(f.read(end - start))
+    buf = b"".join(parts)
+    if not buf.endswith(b"\n"):
+        buf += b"\n"
+    columns = (lambda c: c in usecols) if usecols else None
+    df = pd.read_csv(io.BytesIO(buf), encoding=index["encoding"], low_memory=False, usecols=columns)
+    df["病案号"] = normalize_case_id(df["病案号"])
+    return df[df["病案号"].isin(case_ids)].reset_index(drop=True)
+
+
+# ========== pandas 读取（原有方式，作为回退） ==========
+def read_csv_pandas(path, usecols=None, case_ids=None):
+    """
+    单线程 pandas 读取。
+    usecols：只读取需要的列；case_ids：分块读取并只保留指定病案号的行。
+    """
+    columns = (lambda c: c in usecols) if usecols else None
+    for enc in PANDAS_ENCODINGS:
+        try:
+            if case_ids is None:
+                df = pd.read_csv(path, encoding=enc, low_memory=False, usecols=columns)
+                df["病案号"] = normalize_case_id(df["病案号"])
+                return df
+            parts = []
+            for chunk in pd.read_csv(path, encoding=enc, low_memory=False, usecols=columns,
+                                     chunksize=PANDAS_CHUNK_ROWS):
+                chunk["病案号"] = normalize_case_id(chunk["病案号"])
+                parts.append(chunk[chunk["病案号"].isin(case_ids)])
+            return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["病案号"])
+        except Exception:
+            continue
+    raise ValueError(f"无法读取文件：{path}")
+
+
+# ========== pyarrow 多线程读取 ==========
+def _arrow_case_id(column):
+    """pyarrow 版病案号规范化：去空白并左补0到6位"""
+    return pc.utf8_lpad(pc.utf8_trim_whitespace(column), width=CASE_ID_WIDTH, padding="0")
+
+
+def _arrow_to_pandas(table):
+    """
+    所有列均按字符串读取，再按 pandas 的习惯还原：
+    全部可解析为数字的列转为数值，空值统一为 NaN（后续流程按 NaN 过滤空字段）。
+    """
+    df = table.to_pandas()
+    for col in df.columns:
+        if col == "病案号":
+            continue
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            df[col] = df[col].astype(object).where(df[col].notna(), np.nan)
+    return df
+
+
+def _is_encoding_error(error):
+    """仅编码不匹配（而非格式错误）时才值得换编码重试"""
+    if isinstance(error, UnicodeDecodeError):
+        return True
+    return isinstance(error, pa.ArrowInvalid) and "utf8" in str(error).lower().replace("-", "")
+
+
+def read_csv_arrow(path, usecols=None, case_ids=None):
+    """
+    pyarrow 多线程读取：按表头识别出的编码读取，正文出现编码错误时再尝试 gb18030。
+    引号内含换行的字段（检查结果、医嘱等自由文本）按单个值解析。
+    指定 case_ids 时以流式方式逐批读取并过滤，内存只保留命中的行。
+    """
+    headers, header_encoding = read_csv_headers(path, with_encoding=True)
+    columns = [c for c in headers if not usecols or c in usecols]
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=columns,
+        column_types={c: pa.string() for c in columns},
+        strings_can_be_null=True,
+    )
+    parse_options = pa_csv.ParseOptions(newlines_in_values=True)
+    encodings = ARROW_ENCODINGS if header_encoding.startswith("utf") else ARROW_ENCODINGS[1:]
+    for enc in encodings:
+        read_options = pa_csv.ReadOptions(encoding=enc, use_threads=True, block_size=ARROW_BLOCK_SIZE)
+        try:
+            if case_ids is None:
+                table = pa_csv.read_csv(path, read_options=read_options, parse_options=parse_options,
+                                        convert_options=convert_options)
+                table = table.set_column(table.schema.get_field_index("病案号"), "病案号",
+                                         _arrow_case_id(table["病案号"]))
+            else:
+                wanted = pa.array(sorted(case_ids), type=pa.string())
+                batches = []
+                with pa_csv.open_csv(path, read_options=read_options, parse_options=parse_options,
+                                     convert_options=convert_options) as reader:
+                    for batch in reader:
+                        ids = _arrow_case_id(batch.column("病案号"))
+                        batch = batch.set_column(batch.schema.get_field_index("病案号"), "病案号", ids)
+                        batches.append(batch.filter(pc.is_in(ids, value_set=wanted)))
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+            return _arrow_to_pandas(table)
+        except (pa.ArrowException, UnicodeDecodeError) as e:
+            if enc == encodings[-1] or not _is_encoding_error(e):
+                raise ValueError(f"pyarrow 无法读取文件：{path}（{e}）") from e
+
+
+def read_csv_auto(path, usecols=None, case_ids=None, engine=DEFAULT_CSV_ENGINE):
+    """
+    按 engine 读取；auto 优先使用 pyarrow，失败时回退到 pandas。
+    指定 case_ids 且存在有效的行索引时，只读取命中病案所在的字节区间；
+    无索引时仍需解析整张表（流式过滤只节省内存，不减少读取量）。
+    """
+    if case_ids is not None:
+        index = load_row_index(path)
+        if index is not None:
+            return read_csv_indexed(path, index, usecols, case_ids)
+    if engine in ("auto", "pyarrow") and pa is not None:
+        try:
+            return read_csv_arrow(path, usecols, case_ids)
+        except Exception as e:
+            if engine == "pyarrow":
+                raise
+            print(f"⚠️ pyarrow 读取失败，回退 pandas：{os.path.basename(path)}（{e}）")
+    return read_csv_pandas(path, usecols, case_ids)
+
+
+def build_row_indexes(directory):
+    """为目录下每个 CSV 建立（或刷新已失效的）行索引，返回新建的索引数"""
+    built = 0
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if not filename.lower().endswith(".csv") or filename.startswith("."):
+            continue
+        if load_row_index(path) is not None:
+            continue
+        try:
+            build_row_index(path)
+            built += 1
+        except ValueError as e:
+            # 无“病案号”列等无法建立索引的表，子集读取时按全表读取
+            print(f"⚠️ 未建立行索引：{filename}（{e}）")
+    return built
+
+
+def read_tables(tables, usecols=None, case_ids=None, engine=DEFAULT_CSV_ENGINE, max_workers=4):
+    """
+    并发读取多张表。
+    tables：{表名: 路径}；usecols：{表名: 需要的列集合}。返回 {表名: DataFrame}。
+    """
+    usecols = usecols or {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {name: pool.submit(read_csv_auto, path, usecols.get(name), case_ids, engine)
+                   for name, path in tables.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,179 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from common import build_arg_parser, load_case_ids
+from csv_reader import CSV_ENGINES, DEFAULT_CSV_ENGINE
+
+# ========== 流水线配置 ==========
+# 在 01（格式标准化）与 00（字段选择）完成后，按病案逐个流经 02 → 03 → 03b → 04 → 05：
+# 02 与 03 同时运行，某个病案的 JSON 与 PDF 一旦都已生成即进入报告生成队列，
+# 每份报告完成后立即合并为最终 PDF，不再等待整批完成。
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 1.0  # 扫描新产出文件的间隔（秒）
+
+
+def load_stage(filename, name):
+    """以模块方式加载阶段脚本（脚本名以数字开头，无法直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(UTILS_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_stage(script_name, args):
+    """以子进程启动整批阶段脚本，并在后台线程中转发其日志"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(UTILS_DIR, script_name)] + args,
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+    )
+    tag = script_name.split("_")[0]
+
+    def forward():
+        for line in process.stdout:
+            print(f"[{tag}] {line.rstrip()}", flush=True)
+
+    process.log_thread = threading.Thread(target=forward, daemon=True)
+    process.log_thread.start()
+    return process
+
+
+def list_case_ids(directory, suffix):
+    if not os.path.isdir(directory):
+        return set()
+    return {f[:-len(suffix)] for f in os.listdir(directory) if f.endswith(suffix)}
+
+
+def main(args):
+    workspace = args.workspace
+    case_ids = load_case_ids(args.cases)
+    json_dir = os.path.join(workspace, "data_03_json")
+    pdf_dir = os.path.join(workspace, "data_02_pdf")
+    txt_dir = os.path.join(workspace, "data_04_summary_txt")
+    final_dir = os.path.join(workspace, "data_05_final_pdf")
+    for d in (json_dir, pdf_dir, txt_dir, final_dir):
+        os.makedirs(d, exist_ok=True)
+
+    report_stage = load_stage("04_generate_reports_infini.py", "report_stage")
+    report_stage.set_workspace(workspace)
+    merge_stage = load_stage("05_merge_txt_to_pdf.py", "merge_stage")
+    compact_stage = load_stage("03b_compact_lab_results.py", "compact_stage") if args.compact else None
+
+    with open(report_stage.PROMPT_FILE, "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+    client = report_stage.make_client()
+
+    # 清除本次要处理病案的旧 JSON，避免在 03 重新生成前被误当作新产出
+    for case_id in list_case_ids(json_dir, ".json"):
+        if case_ids is None or case_id in case_ids:
+            os.remove(os.path.join(json_dir, f"{case_id}.json"))
+
+    stage_args = ["--workspace", workspace] + (["--cases", args.cases] if args.cases else [])
+    producers = [start_stage("03_merge_csv_to_json.py", stage_args + ["--csv-engine", args.csv_engine])]
+    if not args.skip_rename:
+        producers.append(start_stage("02_rename_pdf.py", stage_args))
+
+    start_time = time.time()
+    first_result = []
+    merge_pool = ThreadPoolExecutor(max_workers=1)
+    report_pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    counts = {"queued": 0, "reported": 0, "merged": 0}
+    failures = {}  # 病案号 -> 失败原因（04 未生成报告或 05 合并出错）
+    counts_lock = threading.Lock()
+
+    def count(key):
+        with counts_lock:
+            counts[key] += 1
+
+    def fail(case_id, reason):
+        with counts_lock:
+            failures[case_id] = reason
+        print(f"❌ [{case_id}] {reason}", flush=True)
+
+    def merge(case_id, txt_path):
+        try:
+            merge_stage.merge_case(case_id, os.path.join(pdf_dir, f"{case_id}.pdf"), txt_path, final_dir)
+        except Exception as e:
+            fail(case_id, f"合并 PDF 失败：{e}")
+            return
+        count("merged")
+        if not first_result:
+            first_result.append(time.time() - start_time)
+            print(f"⏱️ 首个结果已生成，用时 {first_result[0]:.0f} 秒", flush=True)
+
+    def report(case_id):
+        json_path = os.path.join(json_dir, f"{case_id}.json")
+        if compact_stage is not None:
+            before, after = compact_stage.compact_file(json_path, args.abnormal_only)
+            print(f"🗜️ [{case_id}] {before:,} → {after:,} 字符", flush=True)
+        txt_path = os.path.join(txt_dir, f"{case_id}.txt")
+        if os.path.exists(txt_path):
+            os.remove(txt_path)
+        try:
+            report_stage.process_case(client, f"{case_id}.json", prompt_template, args.mode, args.map_workers)
+        except Exception as e:
+            fail(case_id, f"报告生成失败：{e}")
+            return
+        if not os.path.exists(txt_path):
+            fail(case_id, "报告生成失败，未生成 TXT")
+            return
+        count("reported")
+        merge_pool.submit(merge, case_id, txt_path).add_done_callback(log_error)
+
+    def log_error(future):
+        if future.exception() is not None:
+            print(f"❌ 处理出错：{future.exception()}", flush=True)
+
+    # ========== 调度循环：病案的 JSON 与 PDF 都就绪即入队 ==========
+    queued = set()
+    while True:
+        producers_done = all(p.poll() is not None for p in producers)
+        ready = list_case_ids(json_dir, ".json") & list_case_ids(pdf_dir, ".pdf")
+        if case_ids is not None:
+            ready &= case_ids
+        for case_id in sorted(ready - queued):
+            queued.add(case_id)
+            count("queued")
+            report_pool.submit(report, case_id).add_done_callback(log_error)
+        if producers_done:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    report_pool.shutdown(wait=True)
+    merge_pool.shutdown(wait=True)
+    for p in producers:
+        p.log_thread.join()
+
+    print(f"\n🎯 流水线完成：入队 {counts['queued']} 个病案，生成报告 {counts['reported']} 份，"
+          f"合并 PDF {counts['merged']} 份，总用时 {time.time() - start_time:.0f} 秒")
+    failed = [p.args[1] for p in producers if p.returncode != 0]
+    if failed:
+        print(f"❌ 以下阶段执行失败：{', '.join(os.path.basename(f) for f in failed)}")
+    if failures:
+        print(f"❌ {len(failures)} 个病案未能生成最终 PDF：")
+        for case_id, reason in sorted(failures.items()):
+            print(f"  · {case_id}：{reason}")
+    if failed or failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser("按病案流水线执行 02 → 03 → (03b) → 04 → 05")
+    parser.add_argument("--mode", choices=("serial", "mapreduce"), default=os.environ.get("REPORT_MODE", "serial"),
+                        help="报告生成模式，同 04 阶段")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("REPORT_WORKERS", 1)),
+                        help="同时生成报告的病案数")
+    parser.add_argument("--map-workers", type=int, default=4, help="mapreduce 模式下单个病案内并发的请求数")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default=DEFAULT_CSV_ENGINE,
+                        help="03 阶段的 CSV 读取引擎")
+    parser.add_argument("--skip-rename", action="store_true",
+                        help="PDF 已预先重命名（如批处理的 --prepare），不再启动 02 阶段")
+    parser.add_argument("--compact", action="store_true", help="报告生成前压缩检验结果（03b 阶段）")
+    parser.add_argument("--abnormal-only", action="store_true", help="压缩时检验结果仅保留异常值及首末、极值点")
+    main(parser.parse_args())